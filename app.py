@@ -1,18 +1,51 @@
 import os
+import sqlite3
+import hashlib
+import hmac
+import threading
+import time
+import shutil
+import uuid
+import mmap
+import re
+import json
+import base64
+import bisect
+import math
+import unicodedata
+import cProfile
+import pstats
+import io
+import types
+from contextlib import contextmanager
+from array import array
+from collections import defaultdict
+from datetime import datetime, timezone
 from flask import (
     Flask, request, send_file, jsonify, render_template,
-    abort, Response, redirect, url_for, flash
+    abort, Response, redirect, url_for, flash, g
 )
 from flask_cors import CORS
 from flask_login import (
     LoginManager, UserMixin,
     login_user, login_required, logout_user, current_user
 )
+from werkzeug.http import is_resource_modified
+from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import ClosingIterator, FileWrapper
 from mutagen import File as MutagenFile
-from mutagen.easyid3 import EasyID3
+from mutagen.mp4 import MP4Cover
+from mutagen.flac import FLAC
 import requests
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:   # thumbnails fall back to the full-size image
+    Image = None
 
 
 # ─── App & Login Setup ────────────────────────────────────────────────────────
@@ -23,23 +56,313 @@ CORS(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'  # redirect to /login if @login_required fails
 
-# ─── In‑Memory User Store ────────────────────────────────────────────────────
-users = {
-  'vilero': {'password': 'vilero', 'is_admin': True},
-  # other prebuilt users…
+# ─── Metrics ──────────────────────────────────────────────────────────────────
+# Minimal Prometheus-style counters, gauges and histograms, rendered in the
+# text exposition format by /metrics. Values are per worker process; each
+# worker reports its pid in `vilcore_process_info`.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')   # lets a scraper skip login
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def _format_value(value):
+    # Full precision: `:g` would round byte and request counts past 10^6
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name, self.help = name, help
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.buckets = name, help, buckets
+        self._values = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    out.append((self.name + '_bucket', key + (('le', repr(bound)),), cumulative))
+                out.append((self.name + '_bucket', key + (('le', '+Inf'),), series[-1]))
+                out.append((self.name + '_sum', key, series[-2]))
+                out.append((self.name + '_count', key, series[-1]))
+        return out
+
+
+def render_metrics():
+    lines = [
+        '# HELP vilcore_process_info Worker process serving this scrape.',
+        '# TYPE vilcore_process_info gauge',
+        f'vilcore_process_info{{pid="{os.getpid()}"}} 1',
+    ]
+    for metric in _metrics:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = Histogram('vilcore_request_duration_seconds',
+                            'Time to produce a response, by route.')
+REQUESTS = Counter('vilcore_requests_total', 'Responses sent, by route and status.')
+REQUESTS_IN_FLIGHT = Gauge('vilcore_requests_in_flight',
+                           'Requests whose response body has not finished, by route.')
+STREAM_BYTES = Counter('vilcore_stream_bytes_total', 'Audio bytes sent by /stream.')
+STREAM_RESPONSES = Counter('vilcore_stream_responses_total',
+                           '/stream responses by kind (full, range, multirange, ...).')
+ART_CACHE = Counter('vilcore_art_cache_total',
+                    'Album art requests by cache result (hit, negative, miss).')
+INDEX_SECONDS = Histogram('vilcore_index_seconds',
+                          'Time spent indexing a track, by stage (tags, seek_table).')
+EXTERNAL_SECONDS = Histogram('vilcore_external_request_seconds',
+                             'Outbound HTTP call latency, by service.')
+EXTERNAL_ERRORS = Counter('vilcore_external_request_errors_total',
+                          'Failed outbound HTTP calls, by service.')
+UPLOAD_SECONDS = Histogram('vilcore_upload_receive_seconds',
+                           'Time to stream one uploaded file to disk while hashing.')
+UPLOAD_BYTES = Counter('vilcore_upload_bytes_total', 'Bytes received by /upload.')
+
+
+def _call_on_body_close(response, func):
+    # Response.call_on_close never fires for direct_passthrough bodies
+    # (send_file, the range generators), so hook the body itself. File
+    # wrappers keep their type so gunicorn can still use sendfile.
+    body = response.response
+    if (request.method == 'HEAD' or response.status_code in (204, 304)
+            or response.status_code < 200):
+        func()   # the server never iterates (or closes) these bodies
+    elif not response.direct_passthrough:
+        response.call_on_close(func)
+    elif isinstance(body, types.GeneratorType) or not hasattr(body, 'close'):
+        response.response = ClosingIterator(body, func)
+    else:
+        close = body.close
+
+        def closing():
+            try:
+                close()
+            finally:
+                func()
+
+        body.close = closing
+
+
+@app.before_request
+def _start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+    g.profiler = None
+    if (request.args.get('profile') == '1' and current_user.is_authenticated
+            and current_user.is_admin):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def _finish_request_metrics(response):
+    endpoint = g.get('metrics_endpoint', request.endpoint or 'unmatched')
+    if 'metrics_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_start, endpoint=endpoint)
+        # Streams stay "in flight" until the last byte is handed to the server
+        _call_on_body_close(response, lambda: REQUESTS_IN_FLIGHT.dec(endpoint=endpoint))
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+        response.close()
+        return Response(out.getvalue(), mimetype='text/plain')
+    return response
+
+
+# ─── User Store ───────────────────────────────────────────────────────────────
+# Users live in SQLite (WAL mode) so every gunicorn worker sees the same
+# accounts. load_user runs on every @login_required request, including each
+# /stream range request, so its result is kept in a small per-process TTL cache.
+USERS_DB = 'users.db'
+USER_CACHE_TTL = 60        # seconds; admin flag changes show up after this
+USER_CACHE_MAX = 1024
+
+USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username       TEXT PRIMARY KEY,
+    password_hash  TEXT NOT NULL,
+    is_admin       INTEGER NOT NULL DEFAULT 0,
+    created_at     REAL NOT NULL
+);
+"""
+
+# Prebuilt accounts, created on first start: username -> (password, is_admin)
+DEFAULT_USERS = {
+    'vilero': ('vilero', True),
+    # other prebuilt users…
 }
 
+_users_local = threading.local()
+_users_seeded = None       # USERS_DB path already seeded by this process
+_users_seed_lock = threading.Lock()
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+
+def get_users_db():
+    conn = getattr(_users_local, 'conn', None)
+    if conn is None or _users_local.path != USERS_DB:
+        conn = sqlite3.connect(USERS_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(USERS_SCHEMA)
+        _seed_default_users(conn)
+        _users_local.conn, _users_local.path = conn, USERS_DB
+    return conn
+
+
+def _seed_default_users(conn):
+    # Once per process and database; password hashing is deliberately slow,
+    # so only hash accounts that are actually missing
+    global _users_seeded
+    if _users_seeded == USERS_DB:
+        return
+    with _users_seed_lock:
+        if _users_seeded == USERS_DB:
+            return
+        with conn:
+            for username, (password, is_admin) in DEFAULT_USERS.items():
+                if conn.execute('SELECT 1 FROM users WHERE username = ?',
+                                (username,)).fetchone():
+                    continue
+                conn.execute(
+                    'INSERT OR IGNORE INTO users (username, password_hash, is_admin, created_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    (username, generate_password_hash(password), int(is_admin), time.time()),
+                )
+        _users_seeded = USERS_DB
+
+
 class User(UserMixin):
-    def __init__(self, username):
+    def __init__(self, username, is_admin=False):
         self.id = username
-        self.is_admin = users.get(username, {}).get('is_admin', False)
+        self.is_admin = is_admin
+
+
+def create_user(username, password, is_admin=False):
+    """Insert a new user; returns None if the username is taken."""
+    conn = get_users_db()
+    try:
+        with conn:
+            conn.execute(
+                'INSERT INTO users (username, password_hash, is_admin, created_at) '
+                'VALUES (?, ?, ?, ?)',
+                (username, generate_password_hash(password), int(is_admin), time.time()),
+            )
+    except sqlite3.IntegrityError:
+        return None
+    return User(username, is_admin)
+
+
+def authenticate(username, password):
+    row = get_users_db().execute(
+        'SELECT username, password_hash, is_admin FROM users WHERE username = ?',
+        (username,)
+    ).fetchone()
+    if row is None or not check_password_hash(row['password_hash'], password):
+        return None
+    return User(row['username'], bool(row['is_admin']))
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    if user_id in users:
-        return User(user_id)
-    return None
+    now = time.monotonic()
+    cached = _user_cache.get(user_id)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+
+    row = get_users_db().execute(
+        'SELECT username, is_admin FROM users WHERE username = ?', (user_id,)
+    ).fetchone()
+    if row is None:
+        # Not cached, so an account created on another worker is seen at once
+        return None
+    user = User(row['username'], bool(row['is_admin']))
+    with _user_cache_lock:
+        if len(_user_cache) >= USER_CACHE_MAX:
+            _user_cache.clear()
+        _user_cache[user_id] = (user, now + USER_CACHE_TTL)
+    return user
 
 # ─── Routes: Register, Login, Logout ─────────────────────────────────────────
 @app.route('/register', methods=['GET','POST'])
@@ -47,11 +370,10 @@ def register():
     if request.method == 'POST':
         uname = request.form['username']
         pwd   = request.form['password']
-        if uname in users:
+        user = create_user(uname, pwd)
+        if user is None:
             flash('Username already exists', 'danger')
             return redirect(url_for('register'))
-        users[uname] = {'password': pwd, 'is_admin': False}
-        user = User(uname)
         login_user(user)
         flash('Registration successful! Welcome, ' + uname, 'success')
         return redirect(url_for('index'))
@@ -62,8 +384,8 @@ def login():
     if request.method == 'POST':
         uname = request.form['username']
         pwd   = request.form['password']
-        if users.get(uname, {}).get('password') == pwd:
-            user = User(uname)
+        user = authenticate(uname, pwd)
+        if user is not None:
             login_user(user)
             flash('Logged in successfully!', 'success')
             return redirect(url_for('index'))
@@ -81,15 +403,1417 @@ def logout():
 # ─── Music Player Routes ──────────────────────────────────────────────────────
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXT = {'mp3', 'wav', 'flac', 'm4a', 'aac', 'ogg'}
+AUDIO_MIMETYPES = {
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav',
+    'flac': 'audio/flac',
+    'm4a': 'audio/mp4',
+    'aac': 'audio/aac',
+    'ogg': 'audio/ogg',
+}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXT
 
+# ─── Storage ──────────────────────────────────────────────────────────────────
+# Audio files are read and written through `storage` instead of UPLOAD_FOLDER
+# directly, so several nodes can serve one library from GCS. Remote objects
+# that need to be read locally (tag parsing, popular tracks) are kept in a
+# size-bounded LRU cache on disk; ranged playback of cold tracks is forwarded
+# to the object store.
+#
+# STORAGE_BACKEND=gcs selects GCS. Setting STORAGE_EMULATOR_HOST points the
+# client at a local fake-gcs-server for offline testing, and GCSStorage also
+# accepts any object with the `bucket` API used below; `python -m
+# bench.gcs_stub` checks it against an in-process stub bucket.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+GCS_BUCKET = os.environ.get('GCS_BUCKET', '')
+GCS_PREFIX = os.environ.get('GCS_PREFIX', '')
+STORAGE_CACHE_FOLDER = os.environ.get('STORAGE_CACHE_FOLDER', 'storage_cache')
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+STORAGE_REMOTE_CHUNK_SIZE = 1024 * 1024   # bytes per ranged GET to the store
+STORAGE_STAT_TTL = 30                     # seconds a remote stat is reused
+STORAGE_PREFETCH_WORKERS = 2
+
+
+class DiskCache:
+    """Whole-object LRU cache on local disk, bounded by total size.
+
+    Recency is the file mtime (touched on every hit), so worker processes
+    sharing the directory also share the eviction order. Objects larger than
+    the whole cache are not cached.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._locks = {}   # key -> [lock, threads using it], while downloading
+        self._locks_lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.root, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, src, move=False):
+        """Cache src under key; returns its path, or None if it doesn't fit."""
+        if os.path.getsize(src) > self.max_bytes:
+            if move:
+                os.remove(src)
+            return None
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(key)
+        tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+        if move:
+            os.replace(src, tmp)
+        else:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, path)
+        self._evict(keep=path)
+        return path
+
+    @contextmanager
+    def _key_lock(self, key):
+        with self._locks_lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def fetch(self, key, download, size=None):
+        """Return the cached path for key, calling download(dest) on a miss.
+
+        Returns None without downloading when `size` won't fit in the cache.
+        """
+        path = self.get(key)
+        if path is not None:
+            return path
+        if size is not None and size > self.max_bytes:
+            return None
+        with self._key_lock(key):
+            path = self.get(key)
+            if path is not None:
+                return path
+            tmp = self.scratch_path()
+            try:
+                download(tmp)
+                return self.put(key, tmp, move=True)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def scratch_path(self):
+        """A fresh path in the cache directory that eviction leaves alone."""
+        os.makedirs(self.root, exist_ok=True)
+        return os.path.join(self.root, f'.{uuid.uuid4().hex}.download')
+
+    def _evict(self, keep=None):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(('.tmp', '.download')):
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            if path == keep:
+                continue
+            try:
+                os.remove(path)   # open readers keep their file handle
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+class LocalStorage:
+    """Tracks in a directory on local disk (the default)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def list(self):
+        """Yield (name, size, mtime) for every allowed audio file."""
+        os.makedirs(self.root, exist_ok=True)
+        for entry in os.scandir(self.root):
+            if entry.is_file() and allowed_file(entry.name):
+                st = entry.stat()
+                yield entry.name, st.st_size, st.st_mtime
+
+    def stat(self, name):
+        try:
+            st = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    @contextmanager
+    def local_file(self, name):
+        yield os.path.join(self.root, name)
+
+    def cached_path(self, name):
+        path = os.path.join(self.root, name)
+        return path if os.path.isfile(path) else None
+
+    def prefetch(self, name):
+        pass
+
+    def iter_range(self, name, start, stop):
+        return _iter_file_range(os.path.join(self.root, name), start, stop)
+
+    def put(self, name, src):
+        """Move src into place as name; FileExistsError if name is taken."""
+        os.makedirs(self.root, exist_ok=True)
+        # link() fails instead of overwriting when the name already exists
+        os.link(src, os.path.join(self.root, name))
+        os.remove(src)
+
+
+class GCSStorage:
+    """Tracks in a Google Cloud Storage bucket, read through a DiskCache."""
+
+    def __init__(self, bucket, cache, prefix=''):
+        self.bucket = bucket
+        self.cache = cache
+        self.prefix = prefix
+        self._stats = {}
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=STORAGE_PREFETCH_WORKERS,
+                                            thread_name_prefix='storage-prefetch')
+
+    @classmethod
+    def from_env(cls):
+        from google.cloud import storage as gcs
+
+        if os.environ.get('STORAGE_EMULATOR_HOST'):
+            from google.auth.credentials import AnonymousCredentials
+            client = gcs.Client(project='test', credentials=AnonymousCredentials())
+        else:
+            client = gcs.Client()
+        return cls(client.bucket(GCS_BUCKET),
+                   DiskCache(STORAGE_CACHE_FOLDER, STORAGE_CACHE_MAX_BYTES),
+                   prefix=GCS_PREFIX)
+
+    def _blob_stat(self, blob):
+        return blob.size, blob.updated.timestamp()
+
+    def list(self):
+        stats = {}
+        for blob in self.bucket.list_blobs(prefix=self.prefix):
+            name = blob.name[len(self.prefix):]
+            if '/' in name or not allowed_file(name):
+                continue
+            size, mtime = self._blob_stat(blob)
+            stats[name] = (size, mtime, time.monotonic())
+            yield name, size, mtime
+        # A full listing replaces the stat cache, so deleted objects drop out
+        self._stats = stats
+
+    def stat(self, name):
+        cached = self._stats.get(name)
+        if cached and time.monotonic() - cached[2] < STORAGE_STAT_TTL:
+            return cached[:2]
+        blob = self.bucket.get_blob(self.prefix + name)
+        if blob is None:
+            self._stats.pop(name, None)
+            return None
+        size, mtime = self._blob_stat(blob)
+        self._stats[name] = (size, mtime, time.monotonic())
+        return size, mtime
+
+    def _cache_key(self, name, st):
+        return f'{name}\0{st[0]}\0{st[1]}'
+
+    def _fetch(self, name, st):
+        blob = self.bucket.blob(self.prefix + name)
+        return self.cache.fetch(self._cache_key(name, st), blob.download_to_filename,
+                                size=st[0])
+
+    @contextmanager
+    def local_file(self, name):
+        """Yield a local path holding the object until the block ends.
+
+        Cached copies are hard-linked to a private name first, so another
+        thread's eviction can't remove them mid-read; objects too large for
+        the cache are downloaded to a scratch file instead.
+        """
+        st = self.stat(name)
+        if st is None:
+            raise FileNotFoundError(name)
+        tmp = self.cache.scratch_path()
+        try:
+            while True:
+                path = self._fetch(name, st)
+                if path is None:
+                    self.bucket.blob(self.prefix + name).download_to_filename(tmp)
+                    break
+                try:
+                    os.link(path, tmp)
+                    break
+                except FileNotFoundError:
+                    continue   # evicted between fetch and link; fetch again
+            yield tmp
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def cached_path(self, name):
+        st = self.stat(name)
+        return self.cache.get(self._cache_key(name, st)) if st else None
+
+    def prefetch(self, name):
+        # Pull a track into the cache in the background after a cold play
+        with self._pending_lock:
+            if name in self._pending:
+                return
+            self._pending.add(name)
+
+        def run():
+            try:
+                st = self.stat(name)
+                if st is not None:
+                    self._fetch(name, st)
+            except Exception:
+                app.logger.exception('Failed caching %s', name)
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(name)
+
+        self._executor.submit(run)
+
+    def iter_range(self, name, start, stop):
+        blob = self.bucket.blob(self.prefix + name)
+        while start < stop:
+            end = min(start + STORAGE_REMOTE_CHUNK_SIZE, stop)
+            yield blob.download_as_bytes(start=start, end=end - 1)
+            start = end
+
+    def put(self, name, src):
+        blob = self.bucket.blob(self.prefix + name)
+        try:
+            # Generation 0 means "only if no such object exists yet"
+            blob.upload_from_filename(src, content_type=audio_mimetype(name),
+                                      if_generation_match=0)
+        except _object_exists_errors():
+            raise FileExistsError(name)
+        self._stats.pop(name, None)
+        st = self.stat(name)
+        if st is not None:
+            self.cache.put(self._cache_key(name, st), src, move=True)
+        else:
+            os.remove(src)
+
+
+def _object_exists_errors():
+    # In-process bucket stubs raise FileExistsError and may run without the
+    # Google client libraries installed
+    try:
+        from google.api_core.exceptions import PreconditionFailed
+    except ImportError:
+        return (FileExistsError,)
+    return (PreconditionFailed, FileExistsError)
+
+
+def create_storage():
+    if STORAGE_BACKEND == 'gcs':
+        return GCSStorage.from_env()
+    return LocalStorage(UPLOAD_FOLDER)
+
+
+storage = create_storage()
+
+# ─── Library Catalog ──────────────────────────────────────────────────────────
+# Tag/duration/art info for every track lives in SQLite beside uploads/, so
+# request handlers never have to open audio files with mutagen. Rows are
+# refreshed incrementally whenever a file's (size, mtime) changes, by a
+# background scan that requests kick off (or `flask --app app scan-library`);
+# requests serve whatever is indexed so far.
+LIBRARY_DB = 'library.db'
+LIBRARY_RESCAN_INTERVAL = 30   # seconds between directory re-stats
+LIBRARY_SCAN_BATCH = 50        # parsed tracks committed per transaction
+SONGS_PAGE_MAX = 1000
+LIBRARY_LOG_KEEP = 1000        # generations of change log kept for other workers
+
+LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    filename  TEXT PRIMARY KEY,
+    title     TEXT NOT NULL,
+    artist    TEXT NOT NULL DEFAULT '',
+    album     TEXT NOT NULL DEFAULT '',
+    duration  REAL,
+    bitrate   INTEGER,
+    size      INTEGER NOT NULL,
+    mtime     REAL NOT NULL,
+    art_hash  TEXT,
+    added_at  REAL NOT NULL,
+    content_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS library_meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO library_meta (key, value) VALUES ('generation', 0);
+CREATE TABLE IF NOT EXISTS library_log (
+    generation  INTEGER NOT NULL,
+    filename    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS library_log_generation ON library_log (generation);
+"""
+
+_db_local = threading.local()
+_scan_lock = threading.Lock()
+_last_scan = None
+_scan_thread = None
+_scan_thread_lock = threading.Lock()
+
+
+def get_db():
+    # One connection per thread; WAL lets several gunicorn workers read
+    # while another one is writing.
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.path != LIBRARY_DB:
+        conn = sqlite3.connect(LIBRARY_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(LIBRARY_SCHEMA + SEEK_SCHEMA + ART_SCHEMA + INGEST_SCHEMA)
+        _migrate_tracks(conn)
+        _db_local.conn, _db_local.path = conn, LIBRARY_DB
+    return conn
+
+
+def _migrate_tracks(conn):
+    # Catalogs created before uploads were deduplicated lack content_hash
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(tracks)')}
+    if 'content_hash' not in columns:
+        conn.execute('ALTER TABLE tracks ADD COLUMN content_hash TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS tracks_content_hash ON tracks (content_hash)')
+    conn.commit()
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(INGEST_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def library_generation():
+    row = get_db().execute(
+        "SELECT value FROM library_meta WHERE key = 'generation'"
+    ).fetchone()
+    return row['value']
+
+
+def _bump_generation(conn, filenames):
+    # Record which tracks changed so other processes can update incrementally
+    conn.execute(
+        "UPDATE library_meta SET value = value + 1 WHERE key = 'generation'"
+    )
+    generation = conn.execute(
+        "SELECT value FROM library_meta WHERE key = 'generation'"
+    ).fetchone()['value']
+    conn.executemany(
+        'INSERT INTO library_log (generation, filename) VALUES (?, ?)',
+        [(generation, filename) for filename in filenames],
+    )
+    conn.execute('DELETE FROM library_log WHERE generation <= ?',
+                 (generation - LIBRARY_LOG_KEEP,))
+
+
+def embedded_art(path):
+    """Return (image bytes, mimetype) of the first embedded picture, or None."""
+    try:
+        audio = MutagenFile(path)
+    except Exception:
+        return None
+    if audio is None:
+        return None
+
+    pictures = getattr(audio, 'pictures', None)   # FLAC
+    if pictures:
+        return pictures[0].data, pictures[0].mime or 'image/jpeg'
+
+    tags = audio.tags
+    if not tags:
+        return None
+    if hasattr(tags, 'getall'):                   # ID3 (mp3, wav)
+        for frame in tags.getall('APIC'):
+            return frame.data, frame.mime or 'image/jpeg'
+    elif 'covr' in tags and tags['covr']:         # MP4 (m4a, aac)
+        cover = tags['covr'][0]
+        mime = 'image/png' if cover.imageformat == MP4Cover.FORMAT_PNG else 'image/jpeg'
+        return bytes(cover), mime
+    return None
+
+
+def read_track_info(path):
+    filename = os.path.basename(path)
+    info = {
+        'title': os.path.splitext(filename)[0],
+        'artist': '',
+        'album': '',
+        'duration': None,
+        'bitrate': None,
+        'art_hash': None,
+    }
+    try:
+        meta = MutagenFile(path, easy=True)
+    except Exception:
+        meta = None
+
+    if meta is not None:
+        tags = meta.tags or {}
+        for key in ('title', 'artist', 'album'):
+            try:
+                values = tags.get(key)
+            except Exception:
+                values = None
+            if values and isinstance(values, list) and values[0]:
+                info[key] = str(values[0])
+        info['duration'] = getattr(meta.info, 'length', None)
+        info['bitrate'] = getattr(meta.info, 'bitrate', None)
+
+    art = embedded_art(path)
+    if art:
+        info['art_hash'] = store_art(art[0])
+    return info
+
+
+def parse_track(filename, content_hash=None):
+    """Read tags, art, digest and seek table of a stored track.
+
+    Runs outside any catalog transaction; pass the result to _write_track.
+    """
+    with storage.local_file(filename) as path:
+        with INDEX_SECONDS.time(stage='tags'):
+            info = read_track_info(path)
+        info['content_hash'] = content_hash or file_digest(path)
+        with INDEX_SECONDS.time(stage='seek_table'):
+            seek_table = build_seek_table(path)
+    if seek_table is not None:
+        # Frame-accurate, unlike mutagen's bitrate estimate for VBR files
+        info['duration'] = seek_table[2]
+    return info, seek_table
+
+
+def _write_track(conn, filename, st, info, seek_table, added_at=None):
+    """Write a parsed track's catalog row; st is (size, mtime).
+
+    added_at (default: now) is only set when the row is first inserted.
+    """
+    _store_seek_table(conn, filename, seek_table)
+    conn.execute(
+        """
+        INSERT INTO tracks (filename, title, artist, album, duration, bitrate,
+                            size, mtime, art_hash, added_at, content_hash)
+        VALUES (:filename, :title, :artist, :album, :duration, :bitrate,
+                :size, :mtime, :art_hash, :added_at, :content_hash)
+        ON CONFLICT(filename) DO UPDATE SET
+            title = excluded.title, artist = excluded.artist,
+            album = excluded.album, duration = excluded.duration,
+            bitrate = excluded.bitrate, size = excluded.size,
+            mtime = excluded.mtime, art_hash = excluded.art_hash,
+            content_hash = excluded.content_hash
+        """,
+        dict(info, filename=filename, size=st[0], mtime=st[1],
+             added_at=time.time() if added_at is None else added_at),
+    )
+
+
+def index_file(filename, content_hash=None):
+    """(Re)index a single stored file, e.g. right after an upload."""
+    st = storage.stat(filename)
+    if st is None:
+        return None
+    info, seek_table = parse_track(filename, content_hash)
+    conn = get_db()
+    with conn:
+        _write_track(conn, filename, st, info, seek_table)
+        _bump_generation(conn, [filename])
+    return get_db().execute(
+        'SELECT * FROM tracks WHERE filename = ?', (filename,)
+    ).fetchone()
+
+
+def _scan_is_fresh():
+    return (_last_scan is not None
+            and time.monotonic() - _last_scan < LIBRARY_RESCAN_INTERVAL)
+
+
+def _flush_scan_batch(conn, batch):
+    with conn:
+        for filename, st, info, seek_table in batch:
+            # Files found by a scan were added when they were written, not now
+            _write_track(conn, filename, st, info, seek_table, added_at=st[1])
+        _bump_generation(conn, [item[0] for item in batch])
+    batch.clear()
+
+
+def scan_library(force=False):
+    """Incrementally sync the catalog with the storage backend.
+
+    Only files whose (size, mtime) differ from the stored row are re-parsed.
+    Parsing happens outside any transaction and rows are committed in
+    batches of LIBRARY_SCAN_BATCH, so a long first scan never holds the
+    write lock for more than one batch and keeps its progress if interrupted.
+    Unless `force` is set, storage is re-listed at most once every
+    LIBRARY_RESCAN_INTERVAL seconds per process.
+    """
+    global _last_scan
+    if not force and _scan_is_fresh():
+        return
+    with _scan_lock:
+        if not force and _scan_is_fresh():
+            return
+        conn = get_db()
+        known = {
+            row['filename']: (row['size'], row['mtime'])
+            for row in conn.execute('SELECT filename, size, mtime FROM tracks')
+        }
+
+        batch = []
+        for name, size, mtime in storage.list():
+            if known.pop(name, None) == (size, mtime):
+                continue
+            # Another worker may have indexed it since `known` was read
+            row = conn.execute('SELECT size, mtime FROM tracks WHERE filename = ?',
+                               (name,)).fetchone()
+            if row is not None and (row['size'], row['mtime']) == (size, mtime):
+                continue
+            try:
+                info, seek_table = parse_track(name)
+            except Exception:
+                app.logger.exception('Failed indexing %s', name)
+                continue
+            batch.append((name, (size, mtime), info, seek_table))
+            if len(batch) >= LIBRARY_SCAN_BATCH:
+                _flush_scan_batch(conn, batch)
+        if batch:
+            _flush_scan_batch(conn, batch)
+
+        # Whatever is left in `known` was deleted from storage
+        if known:
+            with conn:
+                for filename in known:
+                    conn.execute('DELETE FROM tracks WHERE filename = ?', (filename,))
+                    conn.execute('DELETE FROM seek_tables WHERE filename = ?', (filename,))
+                _bump_generation(conn, list(known))
+        _last_scan = time.monotonic()
+
+
+def _run_library_scan():
+    global _scan_thread
+    try:
+        scan_library()
+    except Exception:
+        app.logger.exception('Library scan failed')
+    finally:
+        _scan_thread = None
+
+
+def request_library_scan():
+    """Start a background rescan if the last one is stale; never blocks.
+
+    Request handlers call this and serve whatever is already indexed,
+    marking the response with _mark_indexing so clients know to re-poll.
+    """
+    global _scan_thread
+    if _scan_is_fresh() or _scan_thread is not None:
+        return
+    with _scan_thread_lock:
+        if _scan_is_fresh() or _scan_thread is not None:
+            return
+        _scan_thread = threading.Thread(target=_run_library_scan,
+                                        name='library-scan', daemon=True)
+        _scan_thread.start()
+
+
+def _mark_indexing(resp):
+    # Set while this worker's scan runs, e.g. on a library's first request
+    if _scan_thread is not None:
+        resp.headers['X-Library-Indexing'] = '1'
+    return resp
+
+
+@app.cli.command('scan-library')
+def scan_library_command():
+    """Index every track in storage (run before serving a large library)."""
+    start = time.perf_counter()
+    scan_library(force=True)
+    count = get_db().execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+    print(f'{count} tracks indexed in {time.perf_counter() - start:.1f}s')
+
+
+def get_track(filename):
+    row = get_db().execute(
+        'SELECT * FROM tracks WHERE filename = ?', (filename,)
+    ).fetchone()
+    if row is None and allowed_file(filename):
+        # Added to storage since the last scan
+        row = index_file(filename)
+    return row
+
+# ─── Search Index ─────────────────────────────────────────────────────────────
+# Each process keeps an inverted index (token → filenames) over title, artist,
+# album and filename, plus a sorted token list for prefix lookups. It is kept
+# in step with the catalog through `library_log`, so an upload only touches the
+# postings of the tracks it added.
+SEARCH_SORTS = {
+    'artist': lambda t: (t['artist'].lower(), t['album'].lower(), t['title'].lower()),
+    'album': lambda t: (t['album'].lower(), t['title'].lower()),
+    'title': lambda t: (t['title'].lower(),),
+    'added': lambda t: (t['added_at'],),
+}
+SEARCH_PAGE_DEFAULT = 100
+
+_TOKEN_RE = re.compile(r'[^\W_]+')   # secure_filename turns spaces into '_'
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    def __init__(self):
+        self.generation = None
+        self.tracks = {}                    # filename -> track dict
+        self.postings = defaultdict(set)    # token -> {filename}
+        self.vocabulary = []                # sorted tokens, for prefix ranges
+        # sort name -> ([sort key], [filename]) in that order; built on first
+        # use, then kept current by _add/_remove so syncs don't re-sort
+        self._sorted = {}
+        self._lock = threading.Lock()
+
+    def _track_tokens(self, track):
+        stem = os.path.splitext(track['filename'])[0]
+        return set(tokenize(' '.join(
+            (track['title'], track['artist'], track['album'], stem)
+        )))
+
+    def _remove(self, filename):
+        track = self.tracks.pop(filename, None)
+        if track is None:
+            return
+        for sort, (keys, filenames) in self._sorted.items():
+            i = bisect.bisect_left(keys, SEARCH_SORTS[sort](track) + (filename,))
+            del keys[i], filenames[i]
+        for token in self._track_tokens(track):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(filename)
+            if not postings:
+                del self.postings[token]
+                i = bisect.bisect_left(self.vocabulary, token)
+                if i < len(self.vocabulary) and self.vocabulary[i] == token:
+                    del self.vocabulary[i]
+
+    def _add(self, track):
+        self.tracks[track['filename']] = track
+        for sort, (keys, filenames) in self._sorted.items():
+            k = SEARCH_SORTS[sort](track) + (track['filename'],)
+            i = bisect.bisect_left(keys, k)
+            keys.insert(i, k)
+            filenames.insert(i, track['filename'])
+        for token in self._track_tokens(track):
+            if token not in self.postings:
+                bisect.insort(self.vocabulary, token)
+            self.postings[token].add(track['filename'])
+
+    def sync(self):
+        """Bring the index up to date with the catalog generation."""
+        generation = library_generation()
+        if generation == self.generation:
+            return
+        with self._lock:
+            if generation == self.generation:
+                return
+            conn = get_db()
+            if self.generation is None or generation - self.generation >= LIBRARY_LOG_KEEP:
+                self.tracks, self.postings, self.vocabulary = {}, defaultdict(set), []
+                self._sorted = {}
+                for row in conn.execute('SELECT * FROM tracks'):
+                    self._add(dict(row))
+            else:
+                changed = [row['filename'] for row in conn.execute(
+                    'SELECT DISTINCT filename FROM library_log WHERE generation > ?',
+                    (self.generation,)
+                )]
+                for filename in changed:
+                    row = conn.execute(
+                        'SELECT * FROM tracks WHERE filename = ?', (filename,)
+                    ).fetchone()
+                    self._remove(filename)
+                    if row is not None:
+                        self._add(dict(row))
+            self.generation = generation
+
+    def _prefix_matches(self, prefix):
+        matches = set()
+        i = bisect.bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            matches |= self.postings[self.vocabulary[i]]
+            i += 1
+        return matches
+
+    def _sort_key(self, sort):
+        key = SEARCH_SORTS[sort]
+        return lambda filename: key(self.tracks[filename]) + (filename,)
+
+    def _all_sorted(self, sort, key):
+        if sort not in self._sorted:
+            filenames = sorted(self.tracks, key=key)
+            self._sorted[sort] = ([key(f) for f in filenames], filenames)
+        return self._sorted[sort][1]
+
+    def _search(self, query, sort):
+        # Caller holds self._lock
+        tokens = sorted(set(tokenize(query)), key=len, reverse=True)
+        key = self._sort_key(sort)
+        if not tokens:
+            return self._all_sorted(sort, key), key
+
+        # Longest tokens first: they usually narrow the candidates most
+        candidates = None
+        for token in tokens:
+            matches = self._prefix_matches(token)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return [], key
+        if len(candidates) > len(self.tracks) // 8:
+            # Filtering the cached full ordering beats re-sorting
+            return [f for f in self._all_sorted(sort, key) if f in candidates], key
+        return sorted(candidates, key=key), key
+
+    def search(self, query, sort='title'):
+        """Return the filenames matching every query token (as a prefix),
+        ordered by `sort`, and the sort key function."""
+        with self._lock:
+            filenames, key = self._search(query, sort)
+            # The cached orderings are updated in place by later syncs
+            return list(filenames), key
+
+    def page(self, query, sort='title', descending=False, limit=SEARCH_PAGE_DEFAULT,
+             offset=0, cursor=None, fields=()):
+        """Return one page of results as (rows, total, offset, next cursor).
+
+        Everything is read under the lock, so a concurrent sync() can't
+        remove a track between matching and rendering it. Raises ValueError
+        for a cursor that doesn't fit `sort`.
+        """
+        with self._lock:
+            filenames, key = self._search(query, sort)
+            if descending:
+                filenames = filenames[::-1]
+            if cursor is not None:
+                after = _decode_cursor(cursor)
+                if after is None or (filenames and not _cursor_fits(after, key(filenames[0]))):
+                    raise ValueError('Invalid cursor')
+                offset = _position_after(filenames, key, after, descending)
+
+            page = filenames[offset:offset + limit]
+            next_cursor = None
+            if page and offset + limit < len(filenames):
+                next_cursor = _encode_cursor(key(page[-1]))
+            rows = [{k: self.tracks[f][k] for k in fields} for f in page]
+            return rows, len(filenames), offset, next_cursor
+
+
+search_index = SearchIndex()
+
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _position_after(filenames, key, after, descending):
+    # Binary search for the first row sorting after the cursor key
+    lo, hi = 0, len(filenames)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        k = key(filenames[mid])
+        if (k < after) if descending else (k > after):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def _cursor_fits(after, sample):
+    # Same length and element types as a real sort key, so comparing can't fail
+    if len(after) != len(sample):
+        return False
+    for value, expected in zip(after, sample):
+        if isinstance(expected, str):
+            if not isinstance(value, str):
+                return False
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+    return True
+
+
+def _decode_cursor(cursor):
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+    except Exception:
+        return None
+
+
+# ─── Seek Index ───────────────────────────────────────────────────────────────
+# A compact time → byte table per track, built at index time, so a client can
+# turn a seek into a single range request instead of guessing offsets in VBR
+# files. Entry i is the offset of the frame playing at i * SEEK_TABLE_INTERVAL.
+# MP3 and FLAC files are both indexed by walking their frame headers.
+SEEK_TABLE_INTERVAL = 0.5   # seconds
+
+SEEK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seek_tables (
+    filename  TEXT PRIMARY KEY,
+    interval  REAL NOT NULL,
+    offsets   BLOB NOT NULL
+);
+"""
+
+# kbps by (MPEG-1?, layer), indexed by the header's bitrate index
+_MP3_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = (44100, 48000, 32000)
+
+
+def _id3v2_end(buf, pos=0):
+    # Skip (possibly several) ID3v2 tags in front of the audio data
+    while buf[pos:pos + 3] == b'ID3' and len(buf) >= pos + 10:
+        size = 0
+        for b in buf[pos + 6:pos + 10]:
+            size = (size << 7) | (b & 0x7F)
+        pos += 10 + size + (10 if buf[pos + 5] & 0x10 else 0)
+    return pos
+
+
+def _mp3_frame(buf, pos):
+    """Return (length, samples, sample rate) of the MPEG audio frame at pos."""
+    if pos + 4 > len(buf) or buf[pos] != 0xFF:
+        return None
+    b1, b2 = buf[pos + 1], buf[pos + 2]
+    version, layer = (b1 >> 3) & 3, 4 - ((b1 >> 1) & 3)
+    br_index, sr_index, padding = b2 >> 4, (b2 >> 2) & 3, (b2 >> 1) & 1
+    if ((b1 & 0xE0) != 0xE0 or version == 1 or layer == 4
+            or br_index in (0, 15) or sr_index == 3):
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][br_index] * 1000
+    rate = _MP3_SAMPLE_RATES[sr_index] >> {3: 0, 2: 1, 0: 2}[version]
+    if layer == 1:
+        return (12 * bitrate // rate + padding) * 4, 384, rate
+    samples = 1152 if layer == 2 or mpeg1 else 576
+    return samples // 8 * bitrate // rate + padding, samples, rate
+
+
+def _mp3_sync(buf, pos):
+    # Next offset holding two consecutive valid frame headers
+    while True:
+        pos = buf.find(b'\xff', pos)
+        if pos < 0:
+            return None
+        frame = _mp3_frame(buf, pos)
+        if frame and _mp3_frame(buf, pos + frame[0]):
+            return pos
+        pos += 1
+
+
+def _mp3_seek_table(path, interval):
+    with open(path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:   # empty file
+            return None
+    with buf:
+        offsets = array('Q')
+        elapsed = 0.0
+        pos = _mp3_sync(buf, _id3v2_end(buf))
+        first = True
+        while pos is not None:
+            frame = _mp3_frame(buf, pos)
+            if frame is None:
+                pos = _mp3_sync(buf, pos + 1)
+                continue
+            length, samples, rate = frame
+            # A leading Xing/Info/VBRI frame carries no audio
+            if not (first and any(tag in buf[pos + 4:pos + 40]
+                                  for tag in (b'Xing', b'Info', b'VBRI'))):
+                elapsed += samples / rate
+                while len(offsets) * interval < elapsed:
+                    offsets.append(pos)
+            first = False
+            pos += length
+    if not offsets:
+        return None
+    return offsets, elapsed
+
+
+def _flac_audio_offset(path):
+    # Offset of the first audio frame: after 'fLaC' and all metadata blocks
+    with open(path, 'rb') as f:
+        pos = _id3v2_end(f.read(10))
+        f.seek(pos)
+        if f.read(4) != b'fLaC':
+            return None
+        pos += 4
+        while True:
+            block = f.read(4)
+            if len(block) < 4:
+                return None
+            pos += 4 + int.from_bytes(block[1:4], 'big')
+            if block[0] & 0x80:   # last metadata block
+                return pos
+            f.seek(pos)
+
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+_FLAC_SYNC_RE = re.compile(rb'\xff[\xf8\xf9]')
+_FLAC_BLOCK_SIZES = {1: 192, **{c: 576 << (c - 2) for c in range(2, 6)},
+                     **{c: 256 << (c - 8) for c in range(8, 16)}}
+
+
+def _flac_frame(buf, pos):
+    """Return (frame/sample number, block size, variable?) of the FLAC frame
+    header at pos, or None if the bytes there are not a valid header."""
+    if len(buf) < pos + 6:
+        return None
+    b2, b3 = buf[pos + 2], buf[pos + 3]
+    bs_code, sr_code = b2 >> 4, b2 & 0x0F
+    if bs_code == 0 or sr_code == 15 or (b3 >> 4) > 10 or (b3 >> 1) & 7 == 3 or b3 & 1:
+        return None
+    # Frame or sample number, coded like UTF-8 (up to 7 bytes)
+    first, end = buf[pos + 4], pos + 5
+    if first < 0x80:
+        number = first
+    elif first == 0xFF or (first & 0xC0) == 0x80:
+        return None
+    else:
+        extra = 8 - (first ^ 0xFF).bit_length() - 1
+        number = first & (0x3F >> extra)
+        for b in buf[end:end + extra]:
+            if b & 0xC0 != 0x80:
+                return None
+            number = (number << 6) | (b & 0x3F)
+        end += extra
+    if bs_code in (6, 7):
+        size = 1 if bs_code == 6 else 2
+        block = int.from_bytes(buf[end:end + size], 'big') + 1
+        end += size
+    else:
+        block = _FLAC_BLOCK_SIZES[bs_code]
+    end += {12: 1, 13: 2, 14: 2}.get(sr_code, 0)
+    if len(buf) <= end or _crc8(buf[pos:end]) != buf[end]:
+        return None
+    return number, block, bool(buf[pos + 1] & 1)
+
+
+def _flac_seek_table(path, interval):
+    try:
+        audio = FLAC(path)
+    except Exception:
+        return None
+    rate = audio.info.sample_rate
+    first_frame = _flac_audio_offset(path)
+    if not rate or first_frame is None:
+        return None
+    with open(path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:   # empty file
+            return None
+    # Frames carry no length, so walk the sync codes. A candidate only counts
+    # if its CRC-8 checks out and it starts exactly where the previous frame's
+    # samples end, which rules out sync patterns inside audio data.
+    with buf:
+        offsets = array('Q')
+        fixed_block = None
+        next_sample = 0
+        for match in _FLAC_SYNC_RE.finditer(buf, first_frame):
+            pos = match.start()
+            frame = _flac_frame(buf, pos)
+            if frame is None:
+                continue
+            number, block, variable = frame
+            if not variable and fixed_block is None:
+                fixed_block = block   # the first frame of a fixed stream is full size
+            sample = number if variable else number * fixed_block
+            if sample != next_sample:
+                continue
+            next_sample = sample + block
+            while len(offsets) * interval * rate < next_sample:
+                offsets.append(pos)
+    if not offsets:
+        return None
+    return offsets, next_sample / rate
+
+
+def build_seek_table(path, interval=SEEK_TABLE_INTERVAL):
+    """Return (interval, offsets array, duration) for an MP3/FLAC, or None."""
+    ext = path.rsplit('.', 1)[-1].lower()
+    try:
+        if ext == 'mp3':
+            table = _mp3_seek_table(path, interval)
+        elif ext == 'flac':
+            table = _flac_seek_table(path, interval)
+        else:
+            return None
+    except Exception:
+        app.logger.exception('Failed building seek table for %s', path)
+        return None
+    if table is None:
+        return None
+    return interval, table[0], table[1]
+
+
+def _store_seek_table(conn, filename, seek_table):
+    if seek_table is None:
+        conn.execute('DELETE FROM seek_tables WHERE filename = ?', (filename,))
+        return
+    interval, offsets, _ = seek_table
+    conn.execute(
+        'INSERT OR REPLACE INTO seek_tables (filename, interval, offsets) VALUES (?, ?, ?)',
+        (filename, interval, offsets.tobytes()),
+    )
+
+
+def seek_offset(filename, t):
+    """Return (frame time, byte offset) for t seconds into a track, or None."""
+    row = get_db().execute(
+        'SELECT interval, offsets FROM seek_tables WHERE filename = ?', (filename,)
+    ).fetchone()
+    if row is None:
+        return None
+    offsets = array('Q')
+    offsets.frombytes(row['offsets'])
+    i = min(int(t / row['interval']), len(offsets) - 1)
+    return i * row['interval'], offsets[i]
+
+
+# ─── Album Art Cache ──────────────────────────────────────────────────────────
+# Images (embedded or fetched from iTunes) are stored once under ART_CACHE_FOLDER
+# by content hash, with resized JPEG variants next to them. iTunes lookups never
+# run in the request path: they go through a small background pool and their
+# outcome, including "nothing found", is remembered in `art_lookups`.
+ART_CACHE_FOLDER = 'art_cache'
+ART_THUMB_SIZES = {'thumb': 80, 'medium': 160}   # px, longest edge
+ART_MAX_AGE = 7 * 24 * 3600          # browser cache for found art
+ART_NEGATIVE_TTL = 24 * 3600         # retry iTunes after this when nothing found
+ART_ERROR_TTL = 10 * 60              # ... or after this when the lookup failed
+ART_FETCH_WORKERS = 2
+ART_FETCH_QUEUE_MAX = 200
+# Overridable so benchmarks can point lookups at a local stub
+ITUNES_SEARCH_URL = os.environ.get('ITUNES_SEARCH_URL', 'https://itunes.apple.com/search')
+ITUNES_TIMEOUT = (3.05, 10)          # (connect, read) seconds
+
+ART_SCHEMA = """
+CREATE TABLE IF NOT EXISTS art_lookups (
+    filename    TEXT PRIMARY KEY,
+    art_hash    TEXT,
+    checked_at  REAL NOT NULL,
+    expires_at  REAL
+);
+"""
+
+_art_executor = ThreadPoolExecutor(max_workers=ART_FETCH_WORKERS,
+                                   thread_name_prefix='art-fetch')
+_art_pending = set()
+_art_pending_lock = threading.Lock()
+_http_local = threading.local()
+
+
+def http_session():
+    # Pooled keep-alive session, one per worker thread
+    session = getattr(_http_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        _http_local.session = session
+    return session
+
+
+def image_mimetype(head):
+    if head.startswith(b'\x89PNG'):
+        return 'image/png'
+    if head.startswith(b'GIF8'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+def art_cache_path(digest, variant=None):
+    name = digest if variant is None else f'{digest}.{variant}.jpg'
+    return os.path.join(ART_CACHE_FOLDER, name)
+
+
+def store_art(data):
+    """Store image bytes by content hash (once) and return the hash."""
+    digest = hashlib.sha1(data).hexdigest()
+    path = art_cache_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(ART_CACHE_FOLDER, exist_ok=True)
+        tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return digest
+
+
+def art_variant(digest, variant):
+    """Path and mimetype of a cached image, building thumbnails on demand."""
+    original = art_cache_path(digest)
+    if not os.path.exists(original):
+        return None, None
+    size = ART_THUMB_SIZES.get(variant)
+    if size and Image is not None:
+        thumb = art_cache_path(digest, variant)
+        if not os.path.exists(thumb):
+            try:
+                with Image.open(original) as img:
+                    img.thumbnail((size, size))
+                    tmp = f'{thumb}.{uuid.uuid4().hex}.tmp'
+                    img.convert('RGB').save(tmp, 'JPEG', quality=85)
+                os.replace(tmp, thumb)
+            except Exception:
+                app.logger.exception('Failed building %s thumbnail for %s', variant, digest)
+                thumb = None
+        if thumb:
+            return thumb, 'image/jpeg'
+    with open(original, 'rb') as f:
+        return original, image_mimetype(f.read(12))
+
+
+def _art_lookup(filename):
+    return get_db().execute(
+        'SELECT * FROM art_lookups WHERE filename = ?', (filename,)
+    ).fetchone()
+
+
+def _record_art_lookup(filename, digest, ttl):
+    now = time.time()
+    conn = get_db()
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO art_lookups (filename, art_hash, checked_at, expires_at) '
+            'VALUES (?, ?, ?, ?)',
+            (filename, digest, now, now + ttl if ttl else None),
+        )
+
+
+def _fetch_itunes_art(filename, term):
+    service = 'itunes_search'
+    try:
+        session = http_session()
+        with EXTERNAL_SECONDS.time(service=service):
+            resp = session.get(ITUNES_SEARCH_URL,
+                               params={'term': term, 'media': 'music', 'limit': 1},
+                               timeout=ITUNES_TIMEOUT)
+        resp.raise_for_status()
+        results = resp.json().get('results') or []
+        art_url = results[0].get('artworkUrl100') if results else None
+        if not art_url:
+            _record_art_lookup(filename, None, ART_NEGATIVE_TTL)
+            return
+        service = 'itunes_artwork'
+        with EXTERNAL_SECONDS.time(service=service):
+            img = session.get(art_url, timeout=ITUNES_TIMEOUT)
+        img.raise_for_status()
+        _record_art_lookup(filename, store_art(img.content), None)
+    except Exception as e:
+        EXTERNAL_ERRORS.inc(service=service)
+        app.logger.warning('iTunes art lookup failed for %s: %s', filename, e)
+        _record_art_lookup(filename, None, ART_ERROR_TTL)
+    finally:
+        with _art_pending_lock:
+            _art_pending.discard(filename)
+
+
+def schedule_art_fetch(track):
+    with _art_pending_lock:
+        if track['filename'] in _art_pending or len(_art_pending) >= ART_FETCH_QUEUE_MAX:
+            return
+        _art_pending.add(track['filename'])
+    term = ' '.join(filter(None, (track['artist'], track['title'])))
+    _art_executor.submit(_fetch_itunes_art, track['filename'], term)
+
+
 @app.route('/')
 @login_required
 def index():
     return render_template('index.html')
 
+# ─── Upload Ingest ────────────────────────────────────────────────────────────
+# Uploads are streamed to a temp file in UPLOAD_FOLDER while being hashed, then
+# handed to `storage` without ever clobbering an existing file. Identical content
+# is detected by hash and not stored twice. Tag/art/seek-table extraction runs
+# on a bounded pool; its progress is kept in `ingest_jobs` so any worker can
+# answer the client's polling. The pool lives in one process, so jobs left
+# queued/indexing by a worker that restarted are failed after
+# INGEST_JOB_STALE seconds; a file they did store is still indexed by the
+# library scan.
+INGEST_CHUNK_SIZE = 1024 * 1024
+INGEST_WORKERS = 4
+INGEST_JOB_TTL = 24 * 3600
+INGEST_JOB_STALE = 10 * 60
+UPLOAD_MAX_FILES = 50
+
+INGEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id          TEXT PRIMARY KEY,
+    filename    TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+"""
+
+_ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS,
+                                      thread_name_prefix='ingest')
+
+
+def _set_job_status(job_id, status, error=None):
+    conn = get_db()
+    with conn:
+        conn.execute(
+            'UPDATE ingest_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+            (status, error, time.time(), job_id),
+        )
+
+
+def _create_job(conn, filename, content_hash):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn.execute(
+        'INSERT INTO ingest_jobs (id, filename, content_hash, status, created_at, updated_at) '
+        "VALUES (?, ?, ?, 'queued', ?, ?)",
+        (job_id, filename, content_hash, now, now),
+    )
+    return job_id
+
+
+def _fail_stale_jobs(conn, job_id=None):
+    """Mark queued/indexing jobs nobody has touched in INGEST_JOB_STALE
+    seconds (or just job_id, if given) as failed."""
+    now = time.time()
+    with conn:
+        conn.execute(
+            "UPDATE ingest_jobs SET status = 'error', error = ?, updated_at = ? "
+            "WHERE status IN ('queued', 'indexing') AND updated_at < ? "
+            'AND (? IS NULL OR id = ?)',
+            ('Interrupted by a server restart', now, now - INGEST_JOB_STALE,
+             job_id, job_id),
+        )
+
+
+def _claim_upload(conn, filename, content_hash):
+    """Create a queued job for content_hash unless that content is already in
+    the library or still being ingested. Returns (job id, None), or (None,
+    filename of the existing copy)."""
+    # BEGIN IMMEDIATE takes the write lock before the lookup, so two workers
+    # receiving the same bytes can't both see "not there yet" and store it
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        existing = conn.execute(
+            'SELECT filename FROM tracks WHERE content_hash = ? '
+            'UNION ALL '
+            'SELECT filename FROM ingest_jobs WHERE content_hash = ? '
+            "AND status IN ('queued', 'indexing') AND updated_at >= ? "
+            'LIMIT 1',
+            (content_hash, content_hash, time.time() - INGEST_JOB_STALE),
+        ).fetchone()
+        job_id = None if existing else _create_job(conn, filename, content_hash)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return job_id, existing['filename'] if existing else None
+
+
+def _receive_upload(upload_file):
+    """Stream an uploaded file to a temp file, returning (temp path, sha256)."""
+    h = hashlib.sha256()
+    tmp = os.path.join(UPLOAD_FOLDER, f'.upload-{uuid.uuid4().hex}.part')
+    try:
+        with UPLOAD_SECONDS.time(), open(tmp, 'wb') as out:
+            for chunk in iter(lambda: upload_file.stream.read(INGEST_CHUNK_SIZE), b''):
+                h.update(chunk)
+                out.write(chunk)
+                UPLOAD_BYTES.inc(len(chunk))
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return tmp, h.hexdigest()
+
+
+def _place_upload(tmp, filename):
+    """Atomically store tmp as filename, picking name_2.ext etc. if that
+    name is taken. Returns the final filename."""
+    stem, ext = os.path.splitext(filename)
+    candidate, n = filename, 1
+    while True:
+        try:
+            storage.put(candidate, tmp)
+            return candidate
+        except FileExistsError:
+            n += 1
+            candidate = f'{stem}_{n}{ext}'
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def _run_ingest_job(job_id, filename, content_hash):
+    try:
+        _set_job_status(job_id, 'indexing')
+        index_file(filename, content_hash)
+        _set_job_status(job_id, 'ok')
+    except Exception as e:
+        app.logger.exception("Failed indexing %s: %s", filename, e)
+        _set_job_status(job_id, 'error', str(e))
+
+
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload():
@@ -109,131 +1833,476 @@ def upload():
         # No files uploaded
         return jsonify({"error": "No files uploaded"}), 400
 
+    conn = get_db()
+    with conn:
+        conn.execute('DELETE FROM ingest_jobs WHERE updated_at < ?',
+                     (time.time() - INGEST_JOB_TTL,))
+    _fail_stale_jobs(conn)
+
     results = []
-    # limit to 50 files per request
-    for f in files[:50]:
+    for f in files[:UPLOAD_MAX_FILES]:
         filename = secure_filename(f.filename)
         if not filename or not allowed_file(filename):
             results.append({"filename": f.filename, "status": "invalid_type"})
             continue
 
-        dest = os.path.join(UPLOAD_FOLDER, filename)
         try:
-            f.save(dest)
-            results.append({"filename": filename, "status": "ok"})
+            tmp, content_hash = _receive_upload(f)
+            job_id, existing = _claim_upload(conn, filename, content_hash)
+            if job_id is None:
+                os.remove(tmp)
+                results.append({"filename": existing, "status": "duplicate"})
+                continue
+
+            try:
+                filename = _place_upload(tmp, filename)
+            except Exception as e:
+                _set_job_status(job_id, 'error', str(e))
+                raise
+            with conn:
+                conn.execute('UPDATE ingest_jobs SET filename = ? WHERE id = ?',
+                             (filename, job_id))
+            _ingest_executor.submit(_run_ingest_job, job_id, filename, content_hash)
+            results.append({"filename": filename, "status": "queued", "job": job_id})
         except Exception as e:
             app.logger.exception("Failed saving file %s: %s", filename, e)
             results.append({"filename": filename, "status": "error", "error": str(e)})
 
-    return jsonify({"results": results}), 200
+    return jsonify({"results": results}), 202
+
+
+@app.route('/upload/jobs/<job_id>')
+@login_required
+def upload_job(job_id):
+    if not current_user.is_admin:
+        abort(403)
+    conn = get_db()
+    query = 'SELECT id, filename, status, error, updated_at FROM ingest_jobs WHERE id = ?'
+    job = conn.execute(query, (job_id,)).fetchone()
+    if job is None:
+        abort(404)
+    if (job['status'] in ('queued', 'indexing')
+            and job['updated_at'] < time.time() - INGEST_JOB_STALE):
+        _fail_stale_jobs(conn, job_id)
+        job = conn.execute(query, (job_id,)).fetchone()
+    return jsonify({k: job[k] for k in ('id', 'filename', 'status', 'error')})
 
 
 @app.route('/songs')
 @login_required
 def list_songs():
-    from mutagen import File
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    result = []
+    request_library_scan()
+
+    # Cursor pagination: ?limit=N&cursor=<last filename of previous page>
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor', '')
+
+    # The ETag only depends on the catalog generation and the page requested,
+    # so an unchanged library is answered with a 304 without touching `tracks`.
+    etag = hashlib.sha1(
+        f'{library_generation()}|{limit}|{cursor}'.encode()
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return _mark_indexing(resp)
+
+    query = ('SELECT filename, title, artist, album, duration FROM tracks '
+             'WHERE filename > ? ORDER BY filename')
+    params = [cursor]
+    if limit is not None:
+        limit = max(1, min(limit, SONGS_PAGE_MAX))
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+    rows = get_db().execute(query, params).fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]['filename']
+
+    resp = jsonify([dict(row) for row in rows])
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    if next_cursor:
+        resp.headers['X-Next-Cursor'] = next_cursor
+    return _mark_indexing(resp)
+
+
+@app.route('/songs/search')
+@login_required
+def search_songs():
+    request_library_scan()
+    search_index.sync()
+
+    sort = request.args.get('sort', 'title')
+    if sort not in SEARCH_SORTS:
+        return jsonify({"error": "Invalid sort", "sorts": sorted(SEARCH_SORTS)}), 400
+    descending = request.args.get('order', 'asc') == 'desc'
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_DEFAULT, type=int),
+                       SONGS_PAGE_MAX))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    fields = ('filename', 'title', 'artist', 'album', 'duration', 'added_at')
+    try:
+        results, total, offset, next_cursor = search_index.page(
+            request.args.get('q', ''), sort, descending, limit, offset,
+            request.args.get('cursor') or None, fields)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _mark_indexing(jsonify({
+        'results': results,
+        'total': total,
+        'offset': offset,
+        'next_cursor': next_cursor,
+    }))
+
+
+# ─── Streaming ────────────────────────────────────────────────────────────────
+# Single ranges (and full files) of locally available tracks go through
+# send_file. Full 200 responses hand the open file to the server's
+# wsgi.file_wrapper (sendfile under gunicorn); werkzeug wraps every 206 body
+# in a chunked range reader, so ranges are copied through userspace instead.
+# Multi-range requests, and ranges of tracks not yet in the storage cache, are
+# answered with generators reading STREAM_CHUNK_SIZE (or remote chunk) pieces,
+# so memory per connection stays constant regardless of the file size.
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_MAX_RANGES = 16
+
+
+def audio_mimetype(filename):
+    return AUDIO_MIMETYPES.get(filename.rsplit('.', 1)[-1].lower(),
+                               'application/octet-stream')
+
+
+def _iter_file_range(path, start, stop):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
 
-    for filename in os.listdir(UPLOAD_FOLDER):
-        if not allowed_file(filename):
-            continue
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        meta = File(filepath, easy=True)
-        title = meta.get('title', [os.path.splitext(filename)[0]])[0]
-        artist = meta.get('artist', [''])[0]
-        result.append({
-            'filename': filename,
-            'title': title,
-            'artist': artist
-        })
 
-    return jsonify(result)
+_BYTE_RANGE_RE = re.compile(r'\s*(\d*)\s*-\s*(\d*)\s*$', re.ASCII)
 
 
-def get_range(request):
-    range_header = request.headers.get('Range', None)
-    if not range_header:
+def _requested_ranges():
+    """(start, stop) pairs from the Range header, in werkzeug's form, or None
+    to send the whole file.
+
+    werkzeug only accepts ascending, non-overlapping multi-ranges; other valid
+    ones are parsed here and coalesced by _satisfiable_ranges. A header that
+    can't be parsed, or uses another unit, is ignored as RFC 9110 asks.
+    """
+    header = request.headers.get('Range')
+    if header is None:
+        return None
+    if request.range is not None:
+        return request.range.ranges if request.range.units == 'bytes' else None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
         return None
-    _, range_spec = range_header.split('=', 1)
-    start_str, end_str = range_spec.split('-', 1)
-    return int(start_str), int(end_str) if end_str else None
+    ranges = []
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        m = _BYTE_RANGE_RE.match(part)
+        if m is None or not (m.group(1) or m.group(2)):
+            return None
+        first, last = m.groups()
+        if not first:                       # bytes=-N
+            if int(last):
+                ranges.append((-int(last), None))
+            continue
+        if last and int(last) < int(first):
+            return None
+        ranges.append((int(first), int(last) + 1 if last else None))
+    return ranges if ranges or spec.strip() else None
+
+
+def _satisfiable_ranges(ranges, file_size):
+    """Resolve suffix/open-ended ranges to sorted, merged [start, stop) pairs."""
+    spans = []
+    for start, stop in ranges:
+        if start < 0:                       # bytes=-N
+            start, stop = max(file_size + start, 0), file_size
+        else:
+            stop = file_size if stop is None else min(stop, file_size)
+        if start < stop:
+            spans.append([start, stop])
+    spans.sort()
+    merged = []
+    for span in spans:
+        if merged and span[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span[1])
+        else:
+            merged.append(span)
+    return merged
+
+
+def _if_range_matches(etag, last_modified):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == last_modified
+    return True
+
+
+def _multipart_byteranges(read_range, spans, file_size, mimetype, boundary):
+    parts = []
+    for start, stop in spans:
+        head = (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                f'Content-Range: bytes {start}-{stop - 1}/{file_size}\r\n\r\n')
+        parts.append((head.encode('ascii'), start, stop))
+    tail = f'--{boundary}--\r\n'.encode('ascii')
+    length = sum(len(h) + (stop - start) + 2 for h, start, stop in parts) + len(tail)
+
+    def generate():
+        for head, start, stop in parts:
+            yield head
+            yield from read_range(start, stop)
+            yield b'\r\n'
+        yield tail
+
+    return generate(), length
+
+
+def _stream_headers(resp, etag, last_modified):
+    resp.accept_ranges = 'bytes'
+    resp.last_modified = last_modified
+    resp.set_etag(etag)
+    return resp
+
 
 @app.route('/stream/<filename>')
 @login_required
 def stream(filename):
-    path = os.path.join(UPLOAD_FOLDER, filename)
-    if not os.path.isfile(path):
+    try:
+        resp = _stream_response(filename)
+    except RequestedRangeNotSatisfiable:
+        # send_file raises these for local files instead of returning a 416
+        STREAM_RESPONSES.inc(kind='unsatisfiable')
+        raise
+    if resp.status_code == 206:
+        kind = 'multirange' if resp.mimetype == 'multipart/byteranges' else 'range'
+    else:
+        kind = {200: 'full', 304: 'not_modified', 416: 'unsatisfiable'}.get(
+            resp.status_code, str(resp.status_code))
+    STREAM_RESPONSES.inc(kind=kind)
+    if request.method != 'HEAD' and resp.status_code in (200, 206):
+        _count_stream_bytes(resp)
+    return resp
+
+
+class _CountingBody:
+    """Response body that adds the bytes actually handed to the server to
+    STREAM_BYTES when it is closed, so aborted downloads count what was sent."""
+
+    def __init__(self, body):
+        self.body = body
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            STREAM_BYTES.inc(self.sent)
+
+
+def _count_stream_bytes(resp):
+    body = resp.response
+    if isinstance(body, FileWrapper) or hasattr(body, 'filelike'):
+        # Full-file wrappers stay unwrapped so the server can use sendfile,
+        # which doesn't report progress; count their length once closed
+        length = resp.content_length or 0
+        _call_on_body_close(resp, lambda: STREAM_BYTES.inc(length))
+    else:
+        resp.response = _CountingBody(body)
+
+
+def _stream_response(filename):
+    st = storage.stat(filename) if allowed_file(filename) else None
+    if st is None:
         abort(404)
-    file_size = os.path.getsize(path)
-    byte_range = get_range(request)
-    if byte_range:
-        start, end = byte_range
-        end = end or file_size - 1
-        length = end - start + 1
-        with open(path, 'rb') as f:
-            f.seek(start)
-            chunk = f.read(length)
-        resp = Response(chunk, 206, mimetype='audio/mpeg', direct_passthrough=True)
-        resp.headers.add('Content-Range', f'bytes {start}-{end}/{file_size}')
+    size, mtime = st
+    mimetype = audio_mimetype(filename)
+    etag = f'{int(mtime * 1e6):x}-{size:x}'
+    last_modified = datetime.fromtimestamp(int(mtime), timezone.utc)
+
+    path = storage.cached_path(filename)
+    ranges = _requested_ranges()
+    if ranges is None:
+        # Also hides an unparseable header from send_file, which would 416 it
+        request.environ.pop('HTTP_RANGE', None)
+    simple = ranges is None or (request.range is not None and len(ranges) == 1)
+    if path is not None and simple:
+        # Single range, If-Range, suffix ranges and 416s are handled by send_file
+        try:
+            return send_file(os.path.abspath(path), mimetype=mimetype, etag=etag,
+                             last_modified=last_modified, conditional=True)
+        except FileNotFoundError:
+            path = None   # evicted from the storage cache since cached_path()
+
+    if path is not None:
+        def read_range(start, stop):
+            try:
+                yield from _iter_file_range(path, start, stop)
+            except FileNotFoundError:
+                # Evicted before the body started; the file is opened
+                # before its first chunk, so nothing was sent twice
+                yield from storage.iter_range(filename, start, stop)
+    else:
+        # Cold remote object: forward the ranges, and warm the cache for next time
+        storage.prefetch(filename)
+        read_range = lambda start, stop: storage.iter_range(filename, start, stop)
+
+    if not is_resource_modified(request.environ, etag=etag,
+                                last_modified=last_modified):
+        return _stream_headers(Response(status=304), etag, last_modified)
+
+    if ranges is None or not _if_range_matches(etag, last_modified):
+        resp = Response(read_range(0, size), 200, mimetype=mimetype,
+                        direct_passthrough=True)
+        resp.content_length = size
+        return _stream_headers(resp, etag, last_modified)
+
+    spans = _satisfiable_ranges(ranges, size)
+    if not spans or len(spans) > STREAM_MAX_RANGES:
+        resp = Response(status=416)
+        resp.headers['Content-Range'] = f'bytes */{size}'
         return resp
-    return send_file(path, mimetype='audio/mpeg')
+    if len(spans) > 1:
+        boundary = uuid.uuid4().hex
+        body, length = _multipart_byteranges(read_range, spans, size,
+                                             mimetype, boundary)
+        resp = Response(body, 206, direct_passthrough=True,
+                        mimetype=f'multipart/byteranges; boundary={boundary}')
+        resp.content_length = length
+        return _stream_headers(resp, etag, last_modified)
+
+    start, stop = spans[0]
+    resp = Response(read_range(start, stop), 206, mimetype=mimetype,
+                    direct_passthrough=True)
+    resp.content_length = stop - start
+    resp.content_range = f'bytes {start}-{stop - 1}/{size}'
+    return _stream_headers(resp, etag, last_modified)
+
+@app.route('/seek/<filename>')
+@login_required
+def seek(filename):
+    t = request.args.get('t', type=float)
+    if t is None or t < 0:
+        return jsonify({"error": "Missing or invalid t"}), 400
+    track = get_track(filename)
+    if track is None:
+        abort(404)
+    found = seek_offset(filename, t)
+    if found is None:
+        return jsonify({"error": "No seek table for this track"}), 404
+
+    frame_time, offset = found
+    return jsonify({
+        't': frame_time,
+        'offset': offset,
+        'duration': track['duration'],
+        'size': track['size'],
+    })
 
 @app.route('/art/<filename>')
 @login_required
 def art(filename):
-    path = os.path.join(UPLOAD_FOLDER, filename)
-    # 1️⃣ Try embedded artwork
-    try:
-        audio = MutagenFile(path)
-        for tag in audio.tags.values():
-            if hasattr(tag, 'data'):  # e.g. APIC frames in MP3
-                img_data = tag.data
-                return Response(img_data, mimetype='image/jpeg')
-    except Exception:
-        pass
+    variant = request.args.get('size')
+    track = get_track(filename)
+    digest = None
+    cache_result = 'miss'
+
+    if track is not None:
+        # 1️⃣ Embedded artwork, extracted into the cache at index time
+        digest = track['art_hash']
+        if digest and not os.path.exists(art_cache_path(digest)):
+            try:
+                with storage.local_file(filename) as path:
+                    embedded = embedded_art(path)
+            except FileNotFoundError:
+                embedded = None
+            digest = store_art(embedded[0]) if embedded else None
 
-    # 2️⃣ Fallback: search iTunes API
-    term = os.path.splitext(filename)[0]
-    itunes = requests.get(
-        'https://itunes.apple.com/search',
-        params={'term': term, 'media': 'music', 'limit': 1}
-    ).json()
-    if itunes.get('results'):
-        art_url = itunes['results'][0].get('artworkUrl100')
-        if art_url:
-            img = requests.get(art_url).content
-            return Response(img, mimetype='image/jpeg')
-
-    # 3️⃣ Final fallback: default image
-    return send_file(
+        # 2️⃣ Artwork found earlier by the background iTunes lookup
+        if not digest:
+            lookup = _art_lookup(filename)
+            if lookup is not None and lookup['art_hash']:
+                digest = lookup['art_hash']
+            elif lookup is None or (lookup['expires_at'] or 0) < time.time():
+                schedule_art_fetch(track)
+            else:
+                cache_result = 'negative'
+
+    if digest:
+        path, mimetype = art_variant(digest, variant)
+        if path:
+            ART_CACHE.inc(result='hit')
+            resp = send_file(os.path.abspath(path), mimetype=mimetype,
+                             etag=f'{digest}-{variant or "full"}',
+                             max_age=ART_MAX_AGE)
+            # Behind login, so shared caches must not keep it
+            resp.cache_control.public = False
+            resp.cache_control.private = True
+            return resp
+
+    # 3️⃣ Fallback: default image, revalidated so fetched art shows up later
+    ART_CACHE.inc(result=cache_result)
+    resp = send_file(
         os.path.join(app.static_folder, 'images/default.png'),
         mimetype='image/png'
     )
+    resp.cache_control.no_cache = True
+    return resp
 
 @app.route('/metadata/<filename>')
 @login_required
 def metadata(filename):
-    path = os.path.join(UPLOAD_FOLDER, filename)
-    title = os.path.splitext(filename)[0]  # fallback: filename without extension
-    artist = 'Unknown Artist'
+    track = get_track(filename)
+    if track is None:
+        abort(404)
 
-    # Try to read ID3 tags
-    try:
-        tags = EasyID3(path)
-        title = tags.get('title', [title])[0]
-        artist = tags.get('artist', [artist])[0]
-    except Exception:
-        pass  # if no tags or error, keep our defaults
+    return jsonify({
+        'title': track['title'],
+        'artist': track['artist'] or 'Unknown Artist',
+        'album': track['album'],
+        'duration': track['duration'],
+    })
 
-    return jsonify({'title': title, 'artist': artist})
+@app.route('/metrics')
+def metrics():
+    # Admin session, or `Authorization: Bearer $METRICS_TOKEN` for scrapers
+    token = request.headers.get('Authorization', '')
+    if not (METRICS_TOKEN and hmac.compare_digest(token.encode(),
+                                                  f'Bearer {METRICS_TOKEN}'.encode())):
+        if not current_user.is_authenticated:
+            return login_manager.unauthorized()
+        if not current_user.is_admin:
+            abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/admin')
 @login_required
 def admin():
     if not current_user.is_admin:
         abort(403)
-    songs = os.listdir(UPLOAD_FOLDER)
+    request_library_scan()
+    songs = [row['filename'] for row in
+             get_db().execute('SELECT filename FROM tracks ORDER BY filename')]
     return render_template('admin.html', songs=songs)
 
 
@@ -0,0 +1,6 @@
+"""Load and benchmark suite for Vilcore Player.
+
+    python -m bench.library bench_data/1000 --tracks 1000   # synthetic library only
+    python -m bench.run --tracks 1000 --mode both            # full run, JSON report
+    python -m bench.compare old.json new.json                # diff two reports
+"""
@@ -0,0 +1,83 @@
+"""Compare two benchmark reports written by bench.run.
+
+    python -m bench.compare bench_results/<old>.json bench_results/<new>.json
+
+Prints the change in p50/p99 latency, throughput and peak worker RSS for
+every scenario both reports ran, and exits with status 1 if any of them got
+worse by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+# (label, getter, True if higher is better)
+METRICS = (
+    ('p50 ms', lambda s: s['latency_ms']['p50'], False),
+    ('p99 ms', lambda s: s['latency_ms']['p99'], False),
+    ('req/s', lambda s: s['throughput_rps'], True),
+)
+
+
+def _rss(run):
+    rss = run.get('peak_rss_bytes', {})
+    value = rss.get('max_worker') or rss.get('process')
+    return value / 2 ** 20 if value else None
+
+
+def compare(old, new, threshold):
+    """Yield (mode, scenario, metric, old, new, change %, regressed)."""
+    for mode, new_run in new['runs'].items():
+        old_run = old['runs'].get(mode)
+        if old_run is None:
+            continue
+        for scenario, new_stats in new_run['scenarios'].items():
+            old_stats = old_run['scenarios'].get(scenario)
+            if old_stats is None:
+                continue
+            for label, get, higher_is_better in METRICS:
+                yield _row(mode, scenario, label, get(old_stats), get(new_stats),
+                           higher_is_better, threshold)
+        yield _row(mode, '-', 'peak RSS MiB', _rss(old_run), _rss(new_run),
+                   False, threshold)
+
+
+def _row(mode, scenario, label, before, after, higher_is_better, threshold):
+    if not before or after is None:
+        return mode, scenario, label, before, after, None, False
+    change = (after - before) / before * 100
+    worse = -change if higher_is_better else change
+    return mode, scenario, label, before, after, change, worse > threshold
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two bench.run reports.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent change counted as a regression')
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    for report in (old, new):
+        commit = (report['git']['commit'] or 'unknown')[:12]
+        dirty = ' (dirty)' if report['git']['dirty'] else ''
+        print(f"{commit}{dirty}  {report['library']['tracks']} tracks  {report['created_at']}")
+    if old['config'] != new['config']:
+        print('warning: reports were produced with different configs')
+
+    regressions = 0
+    print(f"\n{'mode':<9} {'scenario':<11} {'metric':<13} {'old':>10} {'new':>10} {'change':>8}")
+    for mode, scenario, label, before, after, change, regressed in compare(
+            old, new, args.threshold):
+        regressions += regressed
+        shown = f'{change:+.1f}%' if change is not None else 'n/a'
+        print(f"{mode:<9} {scenario:<11} {label:<13} {before or 0:>10.2f} {after or 0:>10.2f} "
+              f"{shown:>8}{'  REGRESSION' if regressed else ''}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
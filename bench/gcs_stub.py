@@ -0,0 +1,206 @@
+"""In-process stand-in for a Google Cloud Storage bucket.
+
+StubBucket implements the part of the google-cloud-storage `Bucket` API that
+GCSStorage uses (list_blobs, get_blob, blob; ranged downloads; uploads with
+if_generation_match=0), keeping objects in memory. Running this module checks
+GCSStorage against it offline, without the Google client libraries:
+
+    python -m bench.gcs_stub
+"""
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+
+class StubBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def _object(self):
+        obj = self.bucket.objects.get(self.name)
+        if obj is None:
+            raise FileNotFoundError(self.name)
+        return obj
+
+    @property
+    def size(self):
+        obj = self.bucket.objects.get(self.name)
+        return len(obj[0]) if obj else None
+
+    @property
+    def updated(self):
+        obj = self.bucket.objects.get(self.name)
+        return obj[1] if obj else None
+
+    def download_to_filename(self, filename):
+        self.bucket.calls['download'] += 1
+        with open(filename, 'wb') as f:
+            f.write(self._object()[0])
+
+    def download_as_bytes(self, start=None, end=None):
+        # Like the real client, `end` is inclusive
+        self.bucket.calls['download_range'] += 1
+        data = self._object()[0]
+        return data[start or 0:None if end is None else end + 1]
+
+    def upload_from_filename(self, filename, content_type=None, if_generation_match=None):
+        self.bucket.calls['upload'] += 1
+        with open(filename, 'rb') as f:
+            data = f.read()
+        with self.bucket.lock:
+            if if_generation_match == 0 and self.name in self.bucket.objects:
+                raise FileExistsError(self.name)
+            self.bucket.put_object(self.name, data)
+
+
+class StubBucket:
+    def __init__(self):
+        self.objects = {}      # name -> (bytes, updated datetime)
+        self.calls = Counter()
+        self.lock = threading.RLock()
+
+    def put_object(self, name, data):
+        with self.lock:
+            self.objects[name] = (data, datetime.now(timezone.utc))
+
+    def list_blobs(self, prefix=''):
+        self.calls['list'] += 1
+        return [StubBlob(self, name) for name in sorted(self.objects)
+                if name.startswith(prefix)]
+
+    def get_blob(self, name):
+        self.calls['get'] += 1
+        return StubBlob(self, name) if name in self.objects else None
+
+    def blob(self, name):
+        return StubBlob(self, name)
+
+
+# ─── Offline check ────────────────────────────────────────────────────────────
+def _check(label, ok):
+    print(f"{'ok' if ok else 'FAIL'}: {label}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def main():
+    from bench.library import mp3_bytes
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix='gcs-stub-')
+    os.chdir(workdir)   # the app keeps its databases in the cwd
+    sys.path.insert(0, repo_root)
+    import app
+
+    bucket = StubBucket()
+    # Distinct, valid MP3s of known sizes
+    tracks = {f'{name}.mp3': mp3_bytes(seconds) + name.encode()
+              for name, seconds in (('a', 4), ('b', 5), ('c', 6))}
+    for name, data in tracks.items():
+        bucket.put_object('music/' + name, data)
+    bucket.put_object('music/notes.txt', b'not audio')
+    bucket.put_object('music/sub/nested.mp3', tracks['a.mp3'])
+
+    size = max(len(d) for d in tracks.values())
+    cache = app.DiskCache(os.path.join(workdir, 'cache'), max_bytes=size * 2)
+    storage = app.GCSStorage(bucket, cache, prefix='music/')
+
+    listed = {name: st for name, *st in storage.list()}
+    _check('list skips nested and non-audio objects', sorted(listed) == sorted(tracks))
+    _check('list reports object sizes',
+           all(listed[n][0] == len(d) for n, d in tracks.items()))
+
+    gets = bucket.calls['get']
+    _check('stat is served from the listing', storage.stat('a.mp3')[0] == len(tracks['a.mp3'])
+           and bucket.calls['get'] == gets)
+    _check('stat of a missing object is None', storage.stat('missing.mp3') is None)
+
+    app.STORAGE_REMOTE_CHUNK_SIZE = 1000   # force several ranged GETs
+    data = tracks['b.mp3']
+    chunks = list(storage.iter_range('b.mp3', 1500, 4700))
+    _check('ranged read returns the exact bytes', b''.join(chunks) == data[1500:4700])
+    _check('ranged read is split into remote chunks', len(chunks) == 4)
+    _check('cold object is not cached by a ranged read', storage.cached_path('b.mp3') is None)
+
+    with storage.local_file('a.mp3') as path:
+        _check('local_file downloads into the cache',
+               open(path, 'rb').read() == tracks['a.mp3'] and bucket.calls['download'] == 1)
+    _check('local_file removes its private link',
+           not os.path.exists(path) and storage.cached_path('a.mp3') is not None)
+    with storage.local_file('a.mp3'):
+        pass
+    _check('second local_file is a cache hit', bucket.calls['download'] == 1)
+    _check('download locks are dropped once done', not cache._locks)
+
+    with storage.local_file('b.mp3'):
+        pass
+    storage.cached_path('a.mp3')           # touch a, so b is least recently used
+    os.utime(storage.cached_path('b.mp3'), (0, 0))
+    with storage.local_file('c.mp3') as path:
+        # Evicting everything else must keep the readable copy
+        cache.max_bytes = 1
+        cache._evict()
+        readable = open(path, 'rb').read() == tracks['c.mp3']
+        cache.max_bytes = size * 2
+    _check('eviction never removes a file being read', readable)
+
+    with storage.local_file('a.mp3'):
+        pass
+    with storage.local_file('b.mp3'):
+        pass
+    os.utime(storage.cached_path('a.mp3'), (0, 0))
+    with storage.local_file('c.mp3'):
+        pass
+    _check('cache evicts the least recently used object',
+           storage.cached_path('a.mp3') is None and storage.cached_path('b.mp3') is not None
+           and storage.cached_path('c.mp3') is not None)
+
+    cache.max_bytes = 10
+    downloads = bucket.calls['download']
+    with storage.local_file('a.mp3') as path:
+        _check('objects larger than the cache are read from a scratch copy',
+               open(path, 'rb').read() == tracks['a.mp3'])
+    _check('objects larger than the cache are not cached',
+           storage.cached_path('a.mp3') is None and not os.path.exists(path)
+           and bucket.calls['download'] == downloads + 1)
+    cache.max_bytes = size * 2
+
+    src = os.path.join(workdir, 'upload.part')
+    with open(src, 'wb') as f:
+        f.write(mp3_bytes(2) + b'new')
+    storage.put('new.mp3', src)
+    _check('put stores the object and caches it',
+           'music/new.mp3' in bucket.objects and storage.cached_path('new.mp3') is not None
+           and not os.path.exists(src))
+    with open(src, 'wb') as f:
+        f.write(b'other')
+    try:
+        storage.put('new.mp3', src)
+        clobbered = True
+    except FileExistsError:
+        clobbered = False
+    _check('put refuses to overwrite an existing object',
+           not clobbered and bucket.objects['music/new.mp3'][0].endswith(b'new'))
+    os.remove(src)
+
+    # End to end: index, then stream a cold object through the app
+    app.storage = storage
+    app.scan_library(force=True)
+    client = app.app.test_client()
+    client.post('/login', data={'username': 'vilero', 'password': 'vilero'})
+    songs = {row['filename'] for row in client.get('/songs').json}
+    _check('scan indexes every listed track', songs == set(tracks) | {'new.mp3'})
+    cache.max_bytes = 0
+    cache._evict()
+    resp = client.get('/stream/c.mp3', headers={'Range': 'bytes=100-2099'})
+    _check('cold /stream range is forwarded to the bucket',
+           resp.status_code == 206 and resp.get_data() == tracks['c.mp3'][100:2100])
+    print(f'bucket calls: {dict(bucket.calls)}')
+
+
+if __name__ == '__main__':
+    main()
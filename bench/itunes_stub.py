@@ -0,0 +1,99 @@
+"""Local stand-in for the iTunes Search API.
+
+Answers /search like iTunes (one result with an artworkUrl100 pointing back at
+this server, or none) and serves generated cover PNGs, with an optional
+delay to mimic network latency. Point the app at it with
+ITUNES_SEARCH_URL=http://127.0.0.1:<port>/search.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bench.library import png_bytes
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        if stub.delay:
+            time.sleep(stub.delay)
+        if url.path == '/search':
+            term = parse_qs(url.query).get('term', [''])[0]
+            digest = hashlib.sha1(term.encode()).hexdigest()
+            stub.count('search')
+            results = []
+            # A deterministic share of terms has no artwork, like real lookups
+            if int(digest[:4], 16) / 0xFFFF >= stub.miss_ratio:
+                results.append({'artworkUrl100': f'{stub.url}/artwork/{digest[:6]}.png'})
+            body = json.dumps({'resultCount': len(results), 'results': results})
+            self._send(200, body.encode(), 'application/json')
+        elif url.path.startswith('/artwork/'):
+            stub.count('artwork')
+            color = bytes.fromhex(url.path.rsplit('/', 1)[-1][:6].ljust(6, '0'))
+            self._send(200, png_bytes(tuple(color), size=100), 'image/png')
+        else:
+            self._send(404, b'', 'text/plain')
+
+
+class ITunesStub:
+    """ThreadingHTTPServer on a free local port, run in a daemon thread."""
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.05, miss_ratio=0.2):
+        self.delay = delay
+        self.miss_ratio = miss_ratio
+        self.requests = {'search': 0, 'artwork': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self.url = f'http://{host}:{self._server.server_address[1]}'
+        self.search_url = self.url + '/search'
+        self._thread = None
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='itunes-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a fake iTunes Search API.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.05)
+    args = parser.parse_args()
+    stub = ITunesStub(port=args.port, delay=args.delay)
+    print(f'ITUNES_SEARCH_URL={stub.search_url}')
+    stub._server.serve_forever()
@@ -0,0 +1,280 @@
+"""Synthetic music libraries for benchmarking.
+
+Tracks are small but valid MP3, FLAC and WAV files carrying silence, tagged
+and given embedded PNG art with mutagen, so the app's tag parsing, seek
+tables and art cache do the same work as for real files. Everything derives
+from a seed, and a manifest lets an unchanged library be reused across runs.
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import wave
+import zlib
+
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import APIC, ID3, TALB, TIT2, TPE1
+from mutagen.wave import WAVE
+
+MANIFEST = 'library.json'
+FORMATS = {'mp3': 0.7, 'flac': 0.2, 'wav': 0.1}   # share of tracks per format
+ART_SIZE = 300                                     # px, embedded cover edge
+
+_WORDS = (
+    'midnight summer river neon golden echo velvet silent broken electric '
+    'paper ocean crystal wild northern falling burning distant lonely hollow '
+    'silver garden thunder fading rising static honey shadow signal winter '
+    'desert glass radio city morning fever dream heart ghost light fire '
+    'road star rain stone wave sky line house song night day love blue '
+    'café señor über naïve fjörd'
+).split()
+
+# ─── Audio ────────────────────────────────────────────────────────────────────
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, mono: 417-byte frames whose all-zero
+# side info decodes to silence.
+MP3_HEADER = b'\xff\xfb\x90\xc4'
+MP3_FRAME = MP3_HEADER + bytes(417 - len(MP3_HEADER))
+MP3_FRAME_SECONDS = 1152 / 44100
+
+FLAC_RATE = 44100
+FLAC_BLOCK = 4096
+FLAC_SEEK_EVERY = 10        # frames between seek points
+WAV_RATE = 8000
+
+
+def _crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def _crc16(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+    return crc
+
+
+def _flac_utf8(n):
+    # Frame numbers use the UTF-8 byte pattern, without its code point limits
+    if n < 0x80:
+        return bytes([n])
+    tail = []
+    while True:
+        tail.insert(0, 0x80 | (n & 0x3F))
+        n >>= 6
+        if n < (0x40 >> len(tail)):
+            lead = (0xFF00 >> (len(tail) + 1)) & 0xFF
+            return bytes([lead | n] + tail)
+
+
+def _flac_frame(number):
+    # Fixed 4096-sample block, 44.1 kHz, mono, 16 bit; one CONSTANT subframe
+    header = b'\xff\xf8\xc9\x08' + _flac_utf8(number)
+    header += bytes([_crc8(header)])
+    frame = header + b'\x00' + b'\x00\x00'
+    return frame + struct.pack('>H', _crc16(frame))
+
+
+def _flac_block(kind, data, last=False):
+    return bytes([(0x80 if last else 0) | kind]) + len(data).to_bytes(3, 'big') + data
+
+
+def flac_bytes(seconds):
+    frames = [_flac_frame(i) for i in range(max(1, round(seconds * FLAC_RATE / FLAC_BLOCK)))]
+    total = len(frames) * FLAC_BLOCK
+    sizes = [len(f) for f in frames]
+    streaminfo = (
+        struct.pack('>HH', FLAC_BLOCK, FLAC_BLOCK)
+        + min(sizes).to_bytes(3, 'big') + max(sizes).to_bytes(3, 'big')
+        + ((FLAC_RATE << 44) | (0 << 41) | (15 << 36) | total).to_bytes(8, 'big')
+        + bytes(16)                 # MD5 unknown
+    )
+    points, offset = [], 0
+    for i, size in enumerate(sizes):
+        if i % FLAC_SEEK_EVERY == 0:
+            points.append(struct.pack('>QQH', i * FLAC_BLOCK, offset, FLAC_BLOCK))
+        offset += size
+    return (b'fLaC' + _flac_block(0, streaminfo)
+            + _flac_block(3, b''.join(points), last=True) + b''.join(frames))
+
+
+def mp3_bytes(seconds):
+    return MP3_FRAME * max(1, round(seconds / MP3_FRAME_SECONDS))
+
+
+def write_wav(path, seconds):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(WAV_RATE)
+        w.writeframes(bytes(2 * max(1, int(seconds * WAV_RATE))))
+
+
+def png_bytes(color, size=ART_SIZE):
+    """A size x size PNG in `color` with a lighter diagonal stripe pattern."""
+    light = bytes(min(255, c + 60) for c in color)
+    rows = []
+    for y in range(size):
+        row = bytearray(b'\x00')   # filter type: none
+        for x in range(size):
+            row += light if (x + y) // 20 % 2 else bytes(color)
+        rows.append(bytes(row))
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b''.join(rows), 9))
+            + chunk(b'IEND', b''))
+
+
+def write_track(path, tags, seconds, art=None):
+    """Write a silent, tagged track; the format follows the extension."""
+    ext = path.rsplit('.', 1)[-1].lower()
+    if ext == 'wav':
+        write_wav(path, seconds)
+        audio = WAVE(path)
+        audio.add_tags()
+        id3 = audio.tags
+    elif ext == 'flac':
+        with open(path, 'wb') as f:
+            f.write(flac_bytes(seconds))
+        audio = FLAC(path)
+        for key in ('title', 'artist', 'album'):
+            audio[key] = tags[key]
+        if art:
+            pic = Picture()
+            pic.type, pic.mime, pic.data = 3, 'image/png', art
+            pic.width = pic.height = ART_SIZE
+            pic.depth = 24
+            audio.add_picture(pic)
+        audio.save()
+        return
+    elif ext == 'mp3':
+        with open(path, 'wb') as f:
+            f.write(mp3_bytes(seconds))
+        audio, id3 = None, ID3()
+    else:
+        raise ValueError(f'Unsupported format: {ext}')
+
+    id3.add(TIT2(encoding=3, text=tags['title']))
+    id3.add(TPE1(encoding=3, text=tags['artist']))
+    id3.add(TALB(encoding=3, text=tags['album']))
+    if art:
+        id3.add(APIC(encoding=3, mime='image/png', type=3, desc='Cover', data=art))
+    if audio is not None:
+        audio.save()
+    else:
+        id3.save(path)
+
+
+# ─── Libraries ────────────────────────────────────────────────────────────────
+def _words(rng, n):
+    return ' '.join(rng.choice(_WORDS).capitalize() for _ in range(n))
+
+
+def _slug(text):
+    return '_'.join(''.join(c for c in word if c.isascii() and c.isalnum())
+                    for word in text.split()).strip('_') or 'x'
+
+
+def plan_tracks(count, seed, duration, art_ratio, formats=FORMATS, prefix=''):
+    """Deterministic (filename, tags, seconds, album key or None) tuples."""
+    rng = random.Random(seed)
+    artists = [_words(rng, rng.randint(1, 2)) for _ in range(max(1, count // 30))]
+    albums = {}
+    exts, weights = zip(*formats.items())
+    plan = []
+    for i in range(count):
+        artist = rng.choice(artists)
+        album_no = rng.randint(1, 3)
+        key = (artist, album_no)
+        if key not in albums:
+            albums[key] = _words(rng, rng.randint(1, 3))
+        tags = {
+            'title': _words(rng, rng.randint(1, 4)),
+            'artist': artist,
+            'album': albums[key],
+        }
+        ext = rng.choices(exts, weights)[0]
+        seconds = duration * rng.uniform(0.5, 1.5)
+        filename = f'{prefix}{i:05d}_{_slug(artist)}_{_slug(tags["title"])}.{ext}'
+        plan.append((filename, tags, seconds, key if rng.random() < art_ratio else None))
+    return plan
+
+
+def generate_library(root, tracks, seed=1, duration=2.0, art_ratio=0.7,
+                     long_tracks=4, long_duration=300.0, prefix=''):
+    """Fill root with a synthetic library and return its manifest.
+
+    `long_tracks` extra MP3s of `long_duration` seconds are added for range
+    streaming. An existing library with the same parameters is reused.
+    """
+    params = {
+        'tracks': tracks, 'seed': seed, 'duration': duration,
+        'art_ratio': art_ratio, 'long_tracks': long_tracks,
+        'long_duration': long_duration, 'prefix': prefix,
+        'formats': FORMATS,
+    }
+    manifest_path = os.path.join(root, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['params'] == params and all(
+                os.path.exists(os.path.join(root, name)) for name in manifest['files']):
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+
+    os.makedirs(root, exist_ok=True)
+    covers = {}
+    files, long_files = [], []
+    plan = plan_tracks(tracks, seed, duration, art_ratio, prefix=prefix)
+    rng = random.Random(seed + 1)
+    for i in range(long_tracks):
+        tags = {'title': f'Long Track {i + 1}', 'artist': 'Bench', 'album': 'Streaming'}
+        plan.append((f'{prefix}long_{i + 1:02d}.mp3', tags, long_duration, ('Bench', 0)))
+    for filename, tags, seconds, album in plan:
+        art = None
+        if album is not None:
+            if album not in covers:
+                covers[album] = png_bytes(tuple(rng.randrange(40, 196) for _ in range(3)))
+            art = covers[album]
+        write_track(os.path.join(root, filename), tags, seconds, art)
+        (long_files if filename.startswith(f'{prefix}long_') else files).append(filename)
+
+    manifest = {'params': params, 'files': files + long_files,
+                'tracks': files, 'long_tracks': long_files}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root', help='directory to fill (e.g. an uploads/ folder)')
+    parser.add_argument('--tracks', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='mean track length in seconds')
+    parser.add_argument('--art-ratio', type=float, default=0.7,
+                        help='share of tracks with embedded art')
+    parser.add_argument('--long-tracks', type=int, default=4)
+    parser.add_argument('--long-duration', type=float, default=300.0)
+    args = parser.parse_args(argv)
+    manifest = generate_library(args.root, args.tracks, args.seed, args.duration,
+                                args.art_ratio, args.long_tracks, args.long_duration)
+    print(f"{len(manifest['files'])} files in {args.root}")
+
+
+if __name__ == '__main__':
+    main()
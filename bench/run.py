@@ -0,0 +1,542 @@
+"""Benchmark the player against a synthetic library and write a JSON report.
+
+The library is indexed once and that catalog is restored before each mode,
+so every mode starts from the same state. `flask` drives the app in-process
+through Flask test clients; `gunicorn` starts real workers and drives them
+over HTTP. Each scenario sends a fixed number of requests from --clients
+concurrent, logged-in clients and records p50/p90/p99 latency, throughput
+and bytes moved; gunicorn runs also record each worker's peak RSS.
+
+    python -m bench.run --tracks 1000 --mode both
+    python -m bench.run --tracks 50000 --mode gunicorn --workers 8 --clients 64
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bench.itunes_stub import ITunesStub
+from bench.library import MANIFEST, generate_library
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORT_SCHEMA = 1
+SCENARIOS = ('songs', 'songs_page', 'metadata', 'art', 'stream', 'upload')
+BENCH_USER = ('vilero', 'vilero')   # prebuilt admin account, needed for /upload
+
+# Catalog state created by indexing, snapshotted once and restored per mode
+STATE_FILES = ('library.db',)
+STATE_DIRS = ('art_cache',)
+SCRATCH = ('library.db-wal', 'library.db-shm', 'users.db', 'users.db-wal',
+           'users.db-shm', 'storage_cache')
+
+
+# ─── Clients ──────────────────────────────────────────────────────────────────
+class FlaskClient:
+    """In-process client; each instance keeps its own session cookie."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, username, password):
+        resp = self.client.post('/login', data={'username': username,
+                                                'password': password})
+        return resp.status_code == 302 and not resp.location.endswith('/login')
+
+    def get(self, path, headers=None):
+        resp = self.client.get(path, headers=headers)
+        try:
+            return resp.status_code, resp.get_data()
+        finally:
+            resp.close()
+
+    def upload(self, name, data):
+        resp = self.client.post('/upload', data={'files': (io.BytesIO(data), name)},
+                                content_type='multipart/form-data')
+        return resp.status_code, resp.get_data()
+
+
+class HTTPClient:
+    """Keep-alive HTTP client against a running server."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+    def login(self, username, password):
+        resp = self.session.post(self.base_url + '/login', allow_redirects=False,
+                                 data={'username': username, 'password': password})
+        return (resp.status_code == 302
+                and not resp.headers.get('Location', '').endswith('/login'))
+
+    def get(self, path, headers=None):
+        resp = self.session.get(self.base_url + path, headers=headers, timeout=120)
+        return resp.status_code, resp.content
+
+    def upload(self, name, data):
+        resp = self.session.post(self.base_url + '/upload', timeout=120,
+                                 files=[('files', (name, data))])
+        return resp.status_code, resp.content
+
+    def close(self):
+        self.session.close()
+
+
+# ─── Measurement ──────────────────────────────────────────────────────────────
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def summarize(samples, expected, elapsed):
+    ok = sorted(seconds for seconds, status, _ in samples if status == expected)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    total_bytes = sum(n for _, status, n in samples if status == expected)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'requests': len(samples),
+        'ok': len(ok),
+        'errors': len(samples) - len(ok),
+        'statuses': statuses,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(len(ok) / elapsed, 2) if elapsed else None,
+        'bytes': total_bytes,
+        'throughput_mib_s': round(total_bytes / elapsed / 2 ** 20, 3) if elapsed else None,
+        'latency_ms': {
+            'p50': ms(percentile(ok, 50)),
+            'p90': ms(percentile(ok, 90)),
+            'p99': ms(percentile(ok, 99)),
+            'max': ms(ok[-1] if ok else None),
+            'mean': ms(sum(ok) / len(ok) if ok else None),
+        },
+    }
+
+
+def run_load(clients, total, request):
+    """Send `total` requests spread over the clients, one thread per client.
+
+    request(client, i) returns (status, body); returns [(seconds, status,
+    body length)] and the wall time.
+    """
+    counter = itertools.count()   # next() is atomic under the GIL
+
+    def drive(client):
+        samples = []
+        while True:
+            i = next(counter)
+            if i >= total:
+                return samples
+            start = time.perf_counter()
+            try:
+                status, body = request(client, i)
+                n = len(body)
+            except Exception as e:
+                status, n = type(e).__name__, 0
+            samples.append((time.perf_counter() - start, status, n))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        results = list(pool.map(drive, clients))
+    return [s for samples in results for s in samples], time.perf_counter() - start
+
+
+def build_scenarios(manifest, uploads, args):
+    """name -> (request count, expected status, request(client, i), finish).
+
+    finish(client), if set, runs after the load and returns extra fields.
+    """
+    tracks = manifest['tracks']
+    ordered = sorted(tracks)
+    long_tracks = manifest['long_tracks']
+    long_size = {name: os.path.getsize(os.path.join(args.workdir, 'uploads', name))
+                 for name in long_tracks}
+    seed = args.seed
+    jobs = []
+
+    def pick(i, names):
+        return quote(random.Random(seed * 1000003 + i).choice(names))
+
+    def songs(client, i):
+        return client.get('/songs')
+
+    def songs_page(client, i):
+        cursor = random.Random(seed + i).choice(ordered)
+        return client.get(f'/songs?limit=100&cursor={quote(cursor)}')
+
+    def metadata(client, i):
+        return client.get(f'/metadata/{pick(i, tracks)}')
+
+    def art(client, i):
+        # Playlist thumbnails, as rendered by the player
+        return client.get(f'/art/{pick(i, tracks)}?size=thumb')
+
+    def stream(client, i):
+        rng = random.Random(seed + i)
+        name = rng.choice(long_tracks)
+        start = rng.randrange(0, max(1, long_size[name] - args.range_size))
+        end = min(start + args.range_size, long_size[name]) - 1
+        return client.get(f'/stream/{quote(name)}', headers={'Range': f'bytes={start}-{end}'})
+
+    def upload(client, i):
+        name, data = uploads[i]
+        status, body = client.upload(name, data)
+        if status == 202:
+            jobs.extend(r['job'] for r in json.loads(body)['results'] if 'job' in r)
+        return status, body
+
+    def upload_finish(client):
+        return {'ingest_drain_s': round(wait_for_ingest(client, jobs), 4),
+                'ingest_jobs': len(jobs),
+                'upload_bytes': sum(len(data) for _, data in uploads)}
+
+    scenarios = {
+        'songs': (args.requests, 200, songs, None),
+        'songs_page': (args.requests, 200, songs_page, None),
+        'metadata': (args.requests, 200, metadata, None),
+        'art': (args.requests, 200, art, None),
+        'stream': (args.requests, 206, stream, None) if long_tracks else None,
+        'upload': (len(uploads), 202, upload, upload_finish) if uploads else None,
+    }
+    return {name: scenarios[name] for name in args.scenarios if scenarios[name]}
+
+
+def run_scenarios(clients, scenarios):
+    results = {}
+    for name, (total, expected, request, finish) in scenarios.items():
+        samples, elapsed = run_load(clients, total, request)
+        result = results[name] = summarize(samples, expected, elapsed)
+        if finish is not None:
+            result.update(finish(clients[0]))
+        print(f"  {name:<11} {result['throughput_rps']:>9} req/s  "
+              f"p50 {result['latency_ms']['p50']} ms  "
+              f"p99 {result['latency_ms']['p99']} ms  "
+              f"errors {result['errors']}", flush=True)
+    return results
+
+
+def wait_for_ingest(client, jobs, timeout=600):
+    """Seconds until every upload job has left the queue (ok or error)."""
+    start = time.perf_counter()
+    pending = list(jobs)
+    while pending and time.perf_counter() - start < timeout:
+        status, body = client.get(f'/upload/jobs/{pending[0]}')
+        if status == 200 and json.loads(body)['status'] in ('queued', 'indexing'):
+            time.sleep(0.05)
+        else:
+            pending.pop(0)
+    return time.perf_counter() - start
+
+
+def peak_rss_bytes(pid='self'):
+    """Peak resident set size (VmHWM) of a process, or None off Linux."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == 'self':
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def child_pids(pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The ppid follows the parenthesised command name
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return sorted(pids)
+
+
+# ─── Library State ────────────────────────────────────────────────────────────
+def index_library(workdir):
+    """Build the catalog in a fresh process; returns the seconds it took."""
+    code = ('import time, app\n'
+            't = time.perf_counter()\n'
+            'app.scan_library(force=True)\n'
+            'print(time.perf_counter() - t)\n'
+            "app.get_db().execute('PRAGMA wal_checkpoint(TRUNCATE)')\n")
+    out = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=_app_env(),
+                         check=True, stdout=subprocess.PIPE, text=True).stdout
+    return float(out.split()[0])
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def snapshot_state(workdir):
+    snapshot = os.path.join(workdir, 'snapshot')
+    _remove(snapshot)
+    os.makedirs(snapshot)
+    for name in STATE_FILES:
+        shutil.copy2(os.path.join(workdir, name), snapshot)
+    for name in STATE_DIRS:
+        src = os.path.join(workdir, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, os.path.join(snapshot, name))
+
+
+def clear_state(workdir, manifest):
+    """Drop app databases, caches and any files uploaded by earlier runs."""
+    for name in SCRATCH + STATE_FILES + STATE_DIRS:
+        _remove(os.path.join(workdir, name))
+    keep = set(manifest['files']) | {MANIFEST}
+    library = os.path.join(workdir, 'uploads')
+    for name in os.listdir(library):
+        if name not in keep:
+            _remove(os.path.join(library, name))
+
+
+def restore_state(workdir, manifest):
+    """Reset to the freshly indexed library."""
+    clear_state(workdir, manifest)
+    snapshot = os.path.join(workdir, 'snapshot')
+    for name in STATE_FILES:
+        shutil.copy2(os.path.join(snapshot, name), workdir)
+    for name in STATE_DIRS:
+        if os.path.isdir(os.path.join(snapshot, name)):
+            shutil.copytree(os.path.join(snapshot, name), os.path.join(workdir, name))
+
+
+def _app_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (REPO_ROOT, env.get('PYTHONPATH'))))
+    return env
+
+
+# ─── Modes ────────────────────────────────────────────────────────────────────
+def _login_all(clients):
+    for client in clients:
+        if not client.login(*BENCH_USER):
+            raise RuntimeError(f'Could not log in as {BENCH_USER[0]}')
+    return clients
+
+
+def run_flask(args, scenarios):
+    cwd = os.getcwd()
+    os.chdir(args.workdir)   # the app keeps its databases and caches in the cwd
+    try:
+        sys.path.insert(0, REPO_ROOT)
+        import app as player
+
+        clients = _login_all([FlaskClient(player.app) for _ in range(args.clients)])
+        results = run_scenarios(clients, scenarios)
+    finally:
+        os.chdir(cwd)
+    # Clients run in the same process, so this is an upper bound for the app
+    return {'scenarios': results, 'peak_rss_bytes': {'process': peak_rss_bytes()}}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(proc, base_url, workers, log_path, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {proc.returncode}, see {log_path}')
+        try:
+            ready = requests.get(base_url + '/login', timeout=5).status_code == 200
+        except requests.RequestException:
+            ready = False
+        if ready and len(child_pids(proc.pid)) >= workers:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not start within {timeout}s, see {log_path}')
+
+
+def run_gunicorn(args, scenarios):
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    log_path = os.path.join(args.workdir, 'gunicorn.log')
+    cmd = [sys.executable, '-m', 'gunicorn', 'app:app',
+           '--pythonpath', REPO_ROOT, '--bind', f'127.0.0.1:{port}',
+           '--workers', str(args.workers), '--worker-class', 'gthread',
+           '--threads', str(args.threads), '--timeout', '120']
+    with open(log_path, 'w') as log:
+        proc = subprocess.Popen(cmd, cwd=args.workdir, env=_app_env(),
+                                stdout=log, stderr=subprocess.STDOUT)
+    clients = [HTTPClient(base_url) for _ in range(args.clients)]
+    try:
+        _wait_for_server(proc, base_url, args.workers, log_path)
+        results = run_scenarios(_login_all(clients), scenarios)
+        workers = {str(pid): peak_rss_bytes(pid) for pid in child_pids(proc.pid)}
+        rss = {
+            'master': peak_rss_bytes(proc.pid),
+            'workers': workers,
+            'max_worker': max(filter(None, workers.values()), default=None),
+        }
+    finally:
+        for client in clients:
+            client.close()   # idle keep-alive connections would delay shutdown
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return {'scenarios': results, 'peak_rss_bytes': rss,
+            'server': {'workers': args.workers, 'threads': args.threads,
+                       'worker_class': 'gthread'}}
+
+
+MODES = {'flask': run_flask, 'gunicorn': run_gunicorn}
+
+
+# ─── Report ───────────────────────────────────────────────────────────────────
+def git_revision():
+    def git(*argv):
+        return subprocess.run(['git', *argv], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True).stdout.strip()
+
+    return {'commit': git('rev-parse', 'HEAD') or None,
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark Vilcore Player against a synthetic library.')
+    parser.add_argument('--tracks', type=int, default=1000,
+                        help='library size (e.g. 100 to 50000)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='mean track length in seconds')
+    parser.add_argument('--art-ratio', type=float, default=0.7)
+    parser.add_argument('--long-tracks', type=int, default=4,
+                        help='long MP3s used by the stream scenario')
+    parser.add_argument('--long-duration', type=float, default=300.0)
+    parser.add_argument('--mode', choices=('flask', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='requests per scenario')
+    parser.add_argument('--uploads', type=int, default=100,
+                        help='files sent by the upload scenario')
+    parser.add_argument('--range-size', type=int, default=256 * 1024,
+                        help='bytes per /stream range request')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'comma-separated subset of {",".join(SCENARIOS)}')
+    parser.add_argument('--itunes-delay', type=float, default=0.05,
+                        help='seconds the iTunes stub waits before answering')
+    parser.add_argument('--workdir', help='library and app state '
+                        '(default: bench_data/<tracks>)')
+    parser.add_argument('--output', help='report path '
+                        '(default: bench_results/<commit>-<tracks>.json)')
+    args = parser.parse_args(argv)
+
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+    args.workdir = os.path.abspath(args.workdir or os.path.join('bench_data', str(args.tracks)))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    modes = ['flask', 'gunicorn'] if args.mode == 'both' else [args.mode]
+    revision = git_revision()
+
+    start = time.perf_counter()
+    manifest = generate_library(os.path.join(args.workdir, 'uploads'), args.tracks,
+                                args.seed, args.duration, args.art_ratio,
+                                args.long_tracks, args.long_duration)
+    pool = generate_library(os.path.join(args.workdir, 'upload_pool'), args.uploads,
+                            args.seed + 1, args.duration, args.art_ratio,
+                            long_tracks=0, prefix='up_')
+    uploads = []
+    for name in pool['files'] if 'upload' in args.scenarios else []:
+        with open(os.path.join(args.workdir, 'upload_pool', name), 'rb') as f:
+            uploads.append((name, f.read()))
+    library_bytes = sum(os.path.getsize(os.path.join(args.workdir, 'uploads', name))
+                        for name in manifest['files'])
+    print(f"library: {len(manifest['files'])} files, {library_bytes / 2 ** 20:.1f} MiB "
+          f"({time.perf_counter() - start:.1f}s)", flush=True)
+
+    with ITunesStub(delay=args.itunes_delay) as stub:
+        os.environ['ITUNES_SEARCH_URL'] = stub.search_url
+        clear_state(args.workdir, manifest)
+        index_seconds = index_library(args.workdir)
+        print(f'index: {index_seconds:.2f}s', flush=True)
+        snapshot_state(args.workdir)
+
+        runs = {}
+        for mode in modes:
+            print(f'{mode}:', flush=True)
+            restore_state(args.workdir, manifest)
+            scenarios = build_scenarios(manifest, uploads, args)
+            runs[mode] = MODES[mode](args, scenarios)
+        stub_requests = dict(stub.requests)
+
+    report = {
+        'schema': REPORT_SCHEMA,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git': revision,
+        'host': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'config': {k: v for k, v in vars(args).items() if k not in ('workdir', 'output')},
+        'library': {
+            'tracks': len(manifest['tracks']),
+            'long_tracks': len(manifest['long_tracks']),
+            'bytes': library_bytes,
+        },
+        'index': {
+            'seconds': round(index_seconds, 4),
+            'tracks_per_s': round(len(manifest['files']) / index_seconds, 2)
+            if index_seconds else None,
+        },
+        'runs': runs,
+        'itunes_stub_requests': stub_requests,
+    }
+
+    output = args.output or os.path.join(
+        'bench_results', f"{(revision['commit'] or 'unknown')[:12]}-{args.tracks}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f'report: {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -14,11 +14,13 @@ document.addEventListener("DOMContentLoaded", () => {
   const elapsedTimeEl = document.getElementById('elapsedTime');
   const durationTimeEl= document.getElementById('durationTime');
   const playModeBtn = document.getElementById('playModeBtn');
+  const searchInput = document.getElementById('searchInput');
   playModeBtn.onclick = togglePlayMode;
 
 
 
   let playlist = [];
+  let durations = [];             // seconds, from the server-side catalog
   let currentIndex = -1;
   let playMode = 'repeat-all';  // Modes: 'repeat-one', 'repeat-all', 'shuffle'
   let shuffledIndices = [];       // Tracks played songs in shuffle mode
@@ -90,7 +92,14 @@ document.addEventListener("DOMContentLoaded", () => {
               const json = JSON.parse(xhr.responseText);
               // server responds with results array for this single file request
               const r = (json.results && json.results[0]) || json;
-              if (r && r.status === 'ok') {
+              if (r && r.status === 'queued') {
+                status.textContent = 'Processing...';
+                waitForJob(r.job, status).then(resolve, reject);
+              } else if (r && r.status === 'duplicate') {
+                status.textContent = 'Already in library as ' + r.filename;
+                status.classList.add('text-muted');
+                resolve(r);
+              } else if (r && r.status === 'ok') {
                 status.textContent = 'Uploaded';
                 status.classList.add('text-success');
                 resolve(r);
@@ -121,19 +130,53 @@ document.addEventListener("DOMContentLoaded", () => {
       });
     }
 
-    // sequential upload to avoid many simultaneous connections
-    for (const f of toUpload) {
-      try {
+    // poll the server-side ingest job until tags/art are extracted,
+    // backing off from 0.5s to 5s and giving up after about 5 minutes
+    async function waitForJob(jobId, status) {
+      const deadline = Date.now() + 5 * 60 * 1000;
+      for (let delay = 500; ; delay = Math.min(delay * 1.5, 5000)) {
+        if (Date.now() > deadline) {
+          status.textContent = 'Still processing - it will appear in the library when done';
+          status.classList.add('text-muted');
+          throw {status: 'timeout', job: jobId};
+        }
+        // eslint-disable-next-line no-await-in-loop
+        await new Promise(r => setTimeout(r, delay));
+        // eslint-disable-next-line no-await-in-loop
+        const res = await fetch(`/upload/jobs/${jobId}`);
+        if (!res.ok) throw {status: 'error', code: res.status};
         // eslint-disable-next-line no-await-in-loop
-        await uploadSingleFile(f);
-      } catch (err) {
-        console.warn('Upload error', err);
-        // continue to next file (you can stop instead if you prefer)
+        const job = await res.json();
+        if (job.status === 'ok') {
+          status.textContent = 'Uploaded';
+          status.classList.add('text-success');
+          return job;
+        }
+        if (job.status === 'error') {
+          status.textContent = 'Failed: ' + (job.error || 'processing error');
+          status.classList.add('text-danger');
+          throw job;
+        }
+      }
+    }
+
+    // a few uploads at a time, without opening a connection per file
+    const queue = [...toUpload];
+    async function uploadWorker() {
+      while (queue.length) {
+        try {
+          // eslint-disable-next-line no-await-in-loop
+          await uploadSingleFile(queue.shift());
+        } catch (err) {
+          console.warn('Upload error', err);
+          // continue to next file (you can stop instead if you prefer)
+        }
       }
     }
+    await Promise.all(Array.from({ length: 3 }, uploadWorker));
 
-    // Finished: refresh song list (small delay to allow server)
-    setTimeout(loadSongs, 700);
+    // Finished: refresh song list
+    loadSongs();
     // clear file input
     fileInput.value = '';
   };
@@ -141,25 +184,63 @@ document.addEventListener("DOMContentLoaded", () => {
 
 
   // ─── Load & Render Song List ─────────────────────────────────────────────────
+  let loadToken = 0;  // bumped on every reload so stale pages are dropped
+  let indexingTimer;
+  let indexingDelay = 2000;
+
   async function loadSongs() {
-    const res = await fetch('/songs');
-    if (!res.ok) {
-      console.error('Failed to fetch songs');
-      return;
-    }
-    const files = await res.json();
-    playlist = files.map(f => f.filename); // for playTrack()
+    const token = ++loadToken;
+    let indexing = false;
+    clearTimeout(indexingTimer);
+    const q = searchInput ? searchInput.value.trim() : '';
+    playlist = [];
+    durations = [];
+    tableBody.innerHTML = '';
+
+    // Render page by page so the first rows paint before the whole library arrives
+    let cursor = null;
+    do {
+      const params = new URLSearchParams({ q, sort: 'artist', limit: 200 });
+      if (cursor) params.set('cursor', cursor);
+      // eslint-disable-next-line no-await-in-loop
+      const res = await fetch(`/songs/search?${params}`);
+      if (!res.ok) {
+        console.error('Failed to fetch songs');
+        return;
+      }
+      // eslint-disable-next-line no-await-in-loop
+      const page = await res.json();
+      if (token !== loadToken) return;
+      indexing = indexing || res.headers.has('X-Library-Indexing');
+      appendRows(page.results);
+      cursor = page.next_cursor;
+    } while (cursor);
+
     shuffledIndices = generateShuffledIndices(playlist.length);
 
-    tableBody.innerHTML = '';
+    // The server is still indexing the library (e.g. its first scan):
+    // reload until it is done, backing off from 2s to 30s
+    if (indexing) {
+      indexingTimer = setTimeout(loadSongs, indexingDelay);
+      indexingDelay = Math.min(indexingDelay * 2, 30000);
+    } else {
+      indexingDelay = 2000;
+    }
+  }
+
+  function appendRows(files) {
+    files.forEach(file => {
+      const i = playlist.length;
+      playlist.push(file.filename); // for playTrack()
+      durations.push(file.duration || 0);
 
-    files.forEach((file, i) => {
       const row = tableBody.insertRow();
       row.innerHTML = `
         <th scope="row">${i + 1}</th>
         <td class="d-flex align-items-center" style="cursor: pointer;">
-          <img src="/art/${encodeURIComponent(file.filename)}"
+          <img src="/art/${encodeURIComponent(file.filename)}?size=thumb"
               alt="Art"
+              loading="lazy"
               class="me-2 song-thumb">
           <div>
             <strong>${file.title}</strong><br>
@@ -174,6 +255,14 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  if (searchInput) {
+    let searchTimer;
+    searchInput.oninput = () => {
+      clearTimeout(searchTimer);
+      searchTimer = setTimeout(loadSongs, 250);
+    };
+  }
+
   function generateShuffledIndices(length) {
     const indices = Array.from({ length }, (_, i) => i);
     for (let i = indices.length - 1; i > 0; i--) {
@@ -236,17 +325,19 @@ document.addEventListener("DOMContentLoaded", () => {
 
     playPauseBtn.textContent = '⏸️';
 
-    // 4️⃣ Reset times
+    // 4️⃣ Reset times (duration is known up front from the catalog)
     elapsedTimeEl.textContent  = '0:00';
-    durationTimeEl.textContent = '0:00';
+    durationTimeEl.textContent = formatTime(meta.duration || durations[i] || 0);
 
-    // 5️⃣ When metadata is loaded, set duration
+    // 5️⃣ When metadata is loaded, fall back to the browser's duration
     audioPlayer.onloadedmetadata = () => {
-      durationTimeEl.textContent = formatTime(audioPlayer.duration);
+      if (!durations[i] && isFinite(audioPlayer.duration)) {
+        durationTimeEl.textContent = formatTime(audioPlayer.duration);
+      }
     };
 
     // 6️⃣ Fetch album art (you already have this)
-    albumArt.src = `/art/${encodeURIComponent(name)}`;
+    albumArt.src = `/art/${encodeURIComponent(name)}?size=medium`;
   }
 
   function togglePlayMode() {
@@ -290,9 +381,16 @@ document.addEventListener("DOMContentLoaded", () => {
     };
   }
 
+  // Catalog duration is frame-accurate for VBR files; the browser's is an estimate
+  function trackDuration() {
+    return durations[currentIndex] ||
+      (isFinite(audioPlayer.duration) ? audioPlayer.duration : 0);
+  }
+
   audioPlayer.ontimeupdate = () => {
-    if (!audioPlayer.duration) return;
-    const pct = (audioPlayer.currentTime / audioPlayer.duration) * 100;
+    const duration = trackDuration();
+    if (!duration) return;
+    const pct = Math.min((audioPlayer.currentTime / duration) * 100, 100);
     progressBar.style.width = pct + '%';
     elapsedTimeEl.textContent = formatTime(audioPlayer.currentTime);
   };
@@ -358,13 +456,14 @@ document.addEventListener("DOMContentLoaded", () => {
   const progressContainer = document.getElementById('progressContainer');
   if (progressContainer) {
     progressContainer.onclick = function (e) {
-      if (!audioPlayer.duration) return;
+      const duration = trackDuration();
+      if (!duration) return;
 
         const rect = progressContainer.getBoundingClientRect();
         const clickX = e.clientX - rect.left;
         const width = rect.width;
         const percent = clickX / width;
-      audioPlayer.currentTime = percent * audioPlayer.duration;
+      audioPlayer.currentTime = percent * duration;
     };
   }
 